@@ -0,0 +1,95 @@
+"""
+Compare the disk size and pixel time series read speed of raw bil files
+against a compressed PrismArchive, using synthetic 4km sized grids where
+about half the pixels are NODATA.
+
+    python benchmarks/bench_archive.py --days 120 --pixels 50
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import pyPRISMClimate
+from pyPRISMClimate.raster import write_bil
+
+NROWS, NCOLS = 621, 1405
+
+def synthetic_header():
+    return {'BYTEORDER': 'I', 'LAYOUT': 'BIL', 'NROWS': NROWS, 'NCOLS': NCOLS,
+            'NBANDS': 1, 'NBITS': 32, 'PIXELTYPE': 'FLOAT',
+            'ULXMAP': -125.0, 'ULYMAP': 49.9166666666664,
+            'XDIM': 0.0416666666667, 'YDIM': 0.0416666666667, 'NODATA': -9999}
+
+def write_synthetic_days(path, days, seed=0):
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:NROWS, 0:NCOLS]
+    land = ((rows - NROWS / 2) / (NROWS / 2)) ** 2 + ((cols - NCOLS / 2) / (NCOLS / 2)) ** 2 < 0.64
+    base = 10 + 15 * np.sin(rows / 80.0) + 5 * np.cos(cols / 120.0)
+    header = synthetic_header()
+    first_day = datetime(2016, 1, 1)
+    for i in range(days):
+        d = first_day + timedelta(days=i)
+        grid = base + 10 * np.sin(2 * np.pi * i / 365) + rng.normal(0, 0.5, base.shape)
+        grid = np.round(grid, 2)
+        grid[~land] = np.nan
+        filename = 'PRISM_tmean_stable_4kmD2_{d}_bil.bil'.format(d=d.strftime('%Y%m%d'))
+        write_bil(os.path.join(path, filename), grid, header)
+    return land
+
+def folder_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+def run(days, n_pixels, compression, band_rows):
+    work_dir = tempfile.mkdtemp()
+    try:
+        bil_dir = os.path.join(work_dir, 'bil')
+        os.makedirs(bil_dir)
+        land = write_synthetic_days(bil_dir, days)
+        listing = sorted(pyPRISMClimate.prism_iterator(bil_dir), key=lambda f: f['date'])
+
+        start = time.perf_counter()
+        archive = pyPRISMClimate.build_archive(listing, os.path.join(work_dir, 'archive'),
+                                               compression=compression, band_rows=band_rows)
+        build_time = time.perf_counter() - start
+
+        land_rows, land_cols = np.nonzero(land)
+        picks = np.random.default_rng(1).choice(len(land_rows), n_pixels, replace=False)
+        pixels = list(zip(land_rows[picks], land_cols[picks]))
+
+        start = time.perf_counter()
+        raw_series = [np.array([pyPRISMClimate.open_bil(f['full_path']).data[row, col] for f in listing])
+                      for row, col in pixels]
+        raw_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        archive_series = [archive.series(row, col) for row, col in pixels]
+        archive_time = time.perf_counter() - start
+
+        for raw, packed in zip(raw_series, archive_series):
+            np.testing.assert_array_equal(raw, packed)
+
+        bil_size = sum(os.path.getsize(f['full_path']) for f in listing)
+        archive_size = folder_size(os.path.join(work_dir, 'archive'))
+        print('{d} days of {r}x{c} grids, {p} pixel time series, {z}'.format(d=days, r=NROWS, c=NCOLS,
+                                                                               p=n_pixels, z=compression))
+        print('bil size      : {s:.1f} MB'.format(s=bil_size / 1e6))
+        print('archive size  : {s:.1f} MB ({r:.1f}x smaller)'.format(s=archive_size / 1e6, r=bil_size / archive_size))
+        print('archive build : {t:.2f} sec'.format(t=build_time))
+        print('bil reads     : {t:.3f} sec'.format(t=raw_time))
+        print('archive reads : {t:.3f} sec'.format(t=archive_time))
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--pixels', type=int, default=50)
+    parser.add_argument('--compression', default='zlib', choices=['zlib', 'lzma'])
+    parser.add_argument('--band-rows', type=int, default=8)
+    args = parser.parse_args()
+    run(args.days, args.pixels, args.compression, args.band_rows)
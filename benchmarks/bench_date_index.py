@@ -0,0 +1,56 @@
+"""
+Compare looking up dates in an ftp folder listing by scanning every filename
+against the per-folder date index, for a full range of daily requests.
+
+Each date is looked up 3 times, as done by date_available, get_date_status
+and _get_download_url during a download.
+
+    python benchmarks/bench_date_index.py --first-year 2011 --last-year 2020
+"""
+from datetime import datetime, timedelta
+import argparse
+import time
+
+from pyPRISMClimate.base import index_folder_listing
+
+def year_listing(variable, year):
+    first_day = datetime(year, 1, 1)
+    days = (datetime(year + 1, 1, 1) - first_day).days
+    return ['daily/{v}/{y}/PRISM_{v}_stable_4kmD2_{d}_bil.zip'.format(v=variable, y=year,
+                                                                     d=(first_day + timedelta(days=i)).strftime('%Y%m%d'))
+            for i in range(days)]
+
+def scan_lookup(listings, date):
+    matching = [f for f in listings[date.year] if date.strftime('%Y%m%d') in f]
+    return matching[0] if matching else None
+
+def index_lookup(indexes, date):
+    matching = indexes[date.year].get(date.strftime('%Y%m%d'), [])
+    return matching[0]['filename'] if matching else None
+
+def run(first_year, last_year, lookups_per_date=3):
+    listings = {y: year_listing('tmean', y) for y in range(first_year, last_year + 1)}
+    dates = [d for y in listings for d in [datetime(y, 1, 1) + timedelta(days=i) for i in range(len(listings[y]))]]
+
+    start = time.perf_counter()
+    scan_results = [scan_lookup(listings, d) for d in dates for _ in range(lookups_per_date)]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexes = {y: index_folder_listing(l) for y, l in listings.items()}
+    index_results = [index_lookup(indexes, d) for d in dates for _ in range(lookups_per_date)]
+    index_time = time.perf_counter() - start
+
+    assert scan_results == index_results
+
+    print('{n} dates, {l} lookups each'.format(n=len(dates), l=lookups_per_date))
+    print('filename scan: {t:.3f} sec'.format(t=scan_time))
+    print('date index   : {t:.3f} sec (including building the index)'.format(t=index_time))
+    print('speedup      : {s:.0f}x'.format(s=scan_time / index_time))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--first-year', type=int, default=2011)
+    parser.add_argument('--last-year', type=int, default=2020)
+    args = parser.parse_args()
+    run(args.first_year, args.last_year)
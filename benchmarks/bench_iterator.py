@@ -0,0 +1,74 @@
+"""
+Compare prism_iterator against the lazy iter_prism_files and a PrismCatalog
+on a synthetic tree of empty PRISM files laid out as variable/year folders.
+
+The tree is made once in --path and reused on later runs.
+
+    python benchmarks/bench_iterator.py --files 500000 --path /tmp/prism_tree
+"""
+from datetime import datetime, timedelta
+import argparse
+import os
+import time
+
+from pyPRISMClimate import prism_iterator, iter_prism_files, PrismCatalog
+
+VARIABLES = ['ppt', 'tmean', 'tmin', 'tmax', 'tdmean', 'vpdmin', 'vpdmax']
+
+def make_tree(path, n_files):
+    if os.path.exists(os.path.join(path, 'done')):
+        return
+    first_day = datetime(1981, 1, 1)
+    days_per_variable = -(-n_files // len(VARIABLES))
+    made = 0
+    for variable in VARIABLES:
+        for i in range(days_per_variable):
+            if made == n_files:
+                break
+            d = first_day + timedelta(days=i)
+            folder = os.path.join(path, variable, str(d.year))
+            if i == 0 or d.timetuple().tm_yday == 1:
+                os.makedirs(folder, exist_ok=True)
+            filename = 'PRISM_{v}_stable_4kmD2_{d}_bil.bil'.format(v=variable, d=d.strftime('%Y%m%d'))
+            open(os.path.join(folder, filename), 'w').close()
+            made += 1
+    open(os.path.join(path, 'done'), 'w').close()
+
+def timed(description, func):
+    start = time.perf_counter()
+    result = func()
+    print('{d:<45}: {t:.2f} sec'.format(d=description, t=time.perf_counter() - start))
+    return result
+
+def run(path, n_files):
+    timed('making tree of {n} files'.format(n=n_files), lambda: make_tree(path, n_files))
+
+    everything = timed('prism_iterator, all files', lambda: prism_iterator(path, recursive=True))
+    timed('iter_prism_files, first file', lambda: next(iter_prism_files(path, recursive=True)))
+    lazy = timed('iter_prism_files, all files', lambda: list(iter_prism_files(path, recursive=True)))
+    assert len(lazy) == len(everything)
+
+    one_year = timed('prism_iterator + filter, tmax in 2010',
+                     lambda: [f for f in prism_iterator(path, recursive=True)
+                              if f['variable'] == 'tmax' and '2010-01-01' <= f['date'] <= '2010-12-31'])
+    pushdown = timed('iter_prism_files, tmax in 2010',
+                     lambda: list(iter_prism_files(path, recursive=True, variable='tmax',
+                                                   min_date='2010-01-01', max_date='2010-12-31')))
+    assert len(one_year) == len(pushdown)
+
+    db_path = os.path.join(path, 'catalog.sqlite')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    with PrismCatalog(db_path, path) as catalog:
+        timed('catalog, first refresh', catalog.refresh)
+        timed('catalog, refresh with nothing new', catalog.refresh)
+        queried = timed('catalog, tmax in 2010', lambda: catalog.query(variable='tmax', min_date='2010-01-01',
+                                                                       max_date='2010-12-31'))
+        assert len(queried) == len(pushdown)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--files', type=int, default=500000)
+    parser.add_argument('--path', default='prism_tree')
+    args = parser.parse_args()
+    run(args.path, args.files)
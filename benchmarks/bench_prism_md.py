@@ -0,0 +1,46 @@
+"""
+Filenames parsed per second by the full strptime based parser, prism_md
+with its regex fast path, and prism_md_batch.
+
+    python benchmarks/bench_prism_md.py --names 200000
+"""
+from datetime import datetime, timedelta
+import argparse
+import time
+
+from pyPRISMClimate.utils import prism_md, prism_md_batch, _full_prism_md
+
+def synthetic_names(n_names):
+    variables = ['ppt', 'tmean', 'tmin', 'tmax']
+    first_day = datetime(1981, 1, 1)
+    names = []
+    for i in range(n_names):
+        variable = variables[i % len(variables)]
+        if i % 10 == 0:
+            token = (first_day + timedelta(days=31 * (i // 10 % 500))).strftime('%Y%m')
+            names.append('PRISM_{v}_stable_4kmM3_{t}_bil.zip'.format(v=variable, t=token))
+        else:
+            token = (first_day + timedelta(days=i // len(variables) % 15000)).strftime('%Y%m%d')
+            names.append('PRISM_{v}_stable_4kmD2_{t}_bil.zip'.format(v=variable, t=token))
+    return names
+
+def names_per_second(description, names, parse):
+    start = time.perf_counter()
+    result = parse(names)
+    elapsed = time.perf_counter() - start
+    print('{d:<22}: {r:>10,.0f} names/sec'.format(d=description, r=len(names) / elapsed))
+    return result
+
+def run(n_names):
+    names = synthetic_names(n_names)
+    full = names_per_second('full parser', names, lambda n: [_full_prism_md(f) for f in n])
+    fast = names_per_second('prism_md', names, lambda n: [prism_md(f) for f in n])
+    columns = names_per_second('prism_md_batch', names, prism_md_batch)
+    assert full == fast
+    assert columns['date'] == [md['date'] for md in full]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--names', type=int, default=200000)
+    args = parser.parse_args()
+    run(args.names)
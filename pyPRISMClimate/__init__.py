@@ -6,17 +6,90 @@ from .quick_tools import (
         get_prism_monthlys,
         get_prism_monthly_single,
         get_prism_normals,
+        get_prism_batch,
+        get_prism_catalog,
+        )
+
+from .session import PrismSession
+
+from .async_tools import (
+        aget_prism_dailys,
+        aget_prism_monthlys,
+        aget_prism_normals,
+        aiter_prism_dailys,
+        aiter_prism_monthlys,
+        aiter_prism_normals,
+        aiter_prism_downloads,
         )
 
 from .utils import (
         prism_iterator,
+        prism_md_batch,
+        iter_prism_files,
         )
 
+from .raster import open_bil, open_prism_zip, open_prism, read_hdr, PrismRaster
+
+from .cube import build_cube, PrismCube
+from .extract import extract_points
+from .aggregate import aggregate_prism
+from .archive import build_archive, PrismArchive
+from .landcells import land_cells, clear_land_cells, compact_prism, LandCells
+from .derived import derive_prism, join_by_date, GrowingDegreeDays, CumulativeSum, ThresholdCount
+from .zonal import zonal_stats, zone_index, rasterize_zones, ZoneIndex
+from .catalog import PrismCatalog
+from .listing import prism_listing, PrismListing
+
+from .listing_cache import ListingCache
+from .retry import RetryPolicy, CircuitBreaker
+
 __all__ = [
         'get_prism_dailys',
         'get_prism_daily_single',
         'get_prism_monthlys',
         'get_prism_monthly_single',
         'get_prism_normals',
+        'get_prism_batch',
+        'get_prism_catalog',
+        'PrismSession',
+        'aget_prism_dailys',
+        'aget_prism_monthlys',
+        'aget_prism_normals',
+        'aiter_prism_dailys',
+        'aiter_prism_monthlys',
+        'aiter_prism_normals',
+        'aiter_prism_downloads',
         'prism_iterator',
+        'prism_md_batch',
+        'iter_prism_files',
+        'open_bil',
+        'open_prism_zip',
+        'open_prism',
+        'read_hdr',
+        'PrismRaster',
+        'build_cube',
+        'PrismCube',
+        'extract_points',
+        'aggregate_prism',
+        'build_archive',
+        'PrismArchive',
+        'land_cells',
+        'clear_land_cells',
+        'compact_prism',
+        'LandCells',
+        'derive_prism',
+        'join_by_date',
+        'GrowingDegreeDays',
+        'CumulativeSum',
+        'ThresholdCount',
+        'zonal_stats',
+        'zone_index',
+        'rasterize_zones',
+        'ZoneIndex',
+        'PrismCatalog',
+        'prism_listing',
+        'PrismListing',
+        'ListingCache',
+        'RetryPolicy',
+        'CircuitBreaker',
         ]
@@ -0,0 +1,210 @@
+import os
+
+from .raster import np, _require_numpy, open_prism, write_bil, grid_of
+from .utils import select_prism_files, STATUS_RANK, SEASON_MONTHS
+
+AGGREGATE_STATS = ['mean', 'sum', 'min', 'max', 'std', 'count']
+
+def _season_of(year, month):
+    for season, months in SEASON_MONTHS.items():
+        if month in months:
+            return (year + 1 if month == 12 else year, season)
+
+def _period_key(period, year, month):
+    """
+    The group a date belongs to for each aggregation period
+    """
+    if period == 'monthly':
+        return (year, month)
+    elif period == 'seasonal':
+        return _season_of(year, month)
+    elif period == 'annual':
+        return (year,)
+    elif period == 'monthly_climatology':
+        return (month,)
+    elif period == 'annual_climatology':
+        return ()
+    raise ValueError('unknown period: {p}'.format(p=period))
+
+def _output_filename(period, key, variable, stat, status, resolution, n_years):
+    """
+    PRISM style filenames which prism_md can parse. The statistic is added
+    to the variable, ie. PRISM_ppt-sum_stable_4kmA_201601_bil.bil
+    """
+    variable = variable + '-' + stat
+    if period == 'monthly':
+        date_str = '{y}{m:02d}'.format(y=key[0], m=key[1])
+    elif period == 'seasonal':
+        date_str = '{y}{s}'.format(y=key[0], s=key[1])
+    elif period == 'annual':
+        date_str = str(key[0])
+    elif period == 'monthly_climatology':
+        return 'PRISM_{v}_{n}yr_normal_{r}A_{m:02d}_bil.bil'.format(v=variable, n=n_years, r=resolution, m=key[0])
+    elif period == 'annual_climatology':
+        return 'PRISM_{v}_{n}yr_normal_{r}A_annual_bil.bil'.format(v=variable, n=n_years, r=resolution)
+
+    return 'PRISM_{v}_{s}_{r}A_{d}_bil.bil'.format(v=variable, s=status, r=resolution, d=date_str)
+
+class RunningStats:
+    def __init__(self, shape, stats):
+        """
+        Per pixel running statistics of a stream of grids, holding only the
+        accumulators needed for the requested stats. The mean and variance
+        use Welford's method.
+        """
+        self.stats = stats
+        self.count = np.zeros(shape, dtype='i4')
+        if 'sum' in stats:
+            self.sum = np.zeros(shape, dtype='f8')
+        if 'mean' in stats or 'std' in stats:
+            self.mean = np.zeros(shape, dtype='f8')
+            self._delta = np.zeros(shape, dtype='f8')
+        if 'std' in stats:
+            self.m2 = np.zeros(shape, dtype='f8')
+        if 'min' in stats:
+            self.min = np.full(shape, np.inf, dtype='f4')
+        if 'max' in stats:
+            self.max = np.full(shape, -np.inf, dtype='f4')
+
+    def update(self, values, valid):
+        """
+        Add a grid, where valid is False for NODATA pixels
+        """
+        self.count += valid
+        if 'sum' in self.stats:
+            self.sum += np.where(valid, values, 0)
+        if 'mean' in self.stats or 'std' in self.stats:
+            # invalid pixels get a delta of 0 and so are unchanged
+            np.subtract(values, self.mean, out=self._delta, where=valid)
+            self._delta[~valid] = 0
+            self.mean += np.divide(self._delta, self.count, out=np.zeros_like(self._delta), where=self.count > 0)
+            if 'std' in self.stats:
+                self.m2 += self._delta * np.where(valid, values - self.mean, 0)
+        if 'min' in self.stats:
+            np.fmin(self.min, np.where(valid, values, np.inf), out=self.min)
+        if 'max' in self.stats:
+            np.fmax(self.max, np.where(valid, values, -np.inf), out=self.max)
+
+    def result(self, stat, ddof=1):
+        """
+        The final grid for a statistic, with nan where there's no data.
+        """
+        empty = self.count == 0
+        if stat == 'count':
+            return self.count.astype('f4')
+        elif stat == 'sum':
+            result = self.sum
+        elif stat == 'mean':
+            result = self.mean
+        elif stat == 'min':
+            result = self.min
+        elif stat == 'max':
+            result = self.max
+        elif stat == 'std':
+            n = self.count - ddof
+            empty = n <= 0
+            result = np.sqrt(np.divide(self.m2, n, out=np.zeros_like(self.m2), where=~empty))
+        return np.where(empty, np.nan, result).astype('f4')
+
+def aggregate_prism(listing,
+                    dest_path,
+                    period='monthly',
+                    stats=('mean',),
+                    variable=None,
+                    type=None,
+                    ddof=1):
+    """Aggregate PRISM files over time, ie. daily data to monthly means
+
+    Files are read one at a time in date order into running sums, counts,
+    min, max, and variance for each pixel, so memory use does not depend
+    on how many files there are. NODATA pixels are skipped.
+
+    Results are written as bil files with PRISM style names, with the
+    statistic added to the variable name, ie.
+    PRISM_ppt-sum_stable_4kmA_201601_bil.bil. These can be read by
+    prism_iterator. The status is the least final status of the files used.
+
+    Parameters
+    ----------
+    listing : list
+        Output of prism_iterator
+
+    dest_path : str
+        Folder to write the results to
+
+    period : str, optional
+        How to group dates. Either monthly (the default), seasonal (DJF,
+        MAM, JJA, SON, where December is counted in the following year's
+        DJF), annual, monthly_climatology (all Januaries, all Februaries,
+        etc.), or annual_climatology (everything). Climatologies are
+        written with normals style filenames.
+
+    stats : list of str, optional
+        Any of mean, sum, min, max, std, or count. Default is mean only.
+
+    variable : str, optional
+        Only use files for this variable. Required if the listing has more
+        than one variable.
+
+    type : str, optional
+        Only use files of this type, ie. daily. Required if the listing has
+        more than one type.
+
+    ddof : int, optional
+        Delta degrees of freedom for std, default 1 for the sample standard
+        deviation.
+
+    Returns
+    -------
+    list
+        Full paths to the bil files written
+    """
+    _require_numpy()
+    for stat in stats:
+        if stat not in AGGREGATE_STATS:
+            raise ValueError('unknown stat {s}, must be one of {a}'.format(s=stat, a=AGGREGATE_STATS))
+    if not os.path.exists(dest_path):
+        raise RuntimeError('Path does not exist: ' + dest_path)
+
+    selected = select_prism_files(listing, variable, type)
+    # climatology groups are not contiguous in time, so sort by group
+    # first. Within a group files are still in date order.
+    groups = []
+    for date_str in sorted(selected):
+        year, month = int(date_str[:4]), int(date_str[5:7])
+        groups.append((_period_key(period, year, month), date_str))
+    groups.sort()
+
+    written = []
+    group_key, running, group_files, header = None, None, [], None
+
+    def finish_group():
+        status = min((f['status'] for f in group_files), key=lambda s: STATUS_RANK.get(s, -1))
+        n_years = len(set(f['date'][:4] for f in group_files))
+        for stat in stats:
+            filename = _output_filename(period, group_key, group_files[0]['variable'], stat,
+                                        status, group_files[0]['resolution'], n_years)
+            bil_path = os.path.join(dest_path, filename)
+            write_bil(bil_path, running.result(stat, ddof=ddof), header)
+            written.append(bil_path)
+
+    for key, date_str in groups:
+        file_md = selected[date_str]
+        r = open_prism(file_md['full_path'])
+        if key != group_key:
+            if running is not None:
+                finish_group()
+            group_key, group_files, header = key, [], r.header
+            running = RunningStats(r.shape, stats)
+        elif r.grid != grid_of(header):
+            raise ValueError('{p} is not on the same grid as the other files'.format(p=r.path))
+
+        values = np.asarray(r.data, dtype='f4')
+        valid = values != r.nodata if r.nodata is not None else np.ones(values.shape, dtype=bool)
+        running.update(values, valid)
+        group_files.append(file_md)
+
+    if running is not None:
+        finish_group()
+
+    return written
@@ -0,0 +1,244 @@
+import json
+import lzma
+import os
+import tempfile
+import zlib
+
+from .raster import np, _require_numpy, open_prism, grid_of, xy_to_rowcol
+from .utils import select_prism_files
+
+COMPRESSORS = {'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+               'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)}
+
+def _shuffle(values):
+    """
+    Group the bytes of float32 values by position, ie. all the first bytes,
+    then all the second bytes, etc. The exponent bytes of nearby values are
+    nearly the same, so this compresses much better.
+    """
+    return np.ascontiguousarray(values.view('u1').reshape(-1, 4).T).tobytes()
+
+def _unshuffle(data, n_values):
+    return np.frombuffer(data, dtype='u1').reshape(4, n_values).T.copy().view('<f4').reshape(-1)
+
+def _chunk_sources(selected, chunk_dates, header, staging):
+    """
+    The data of every file in a time chunk, opened one at a time. Memory
+    mapped bil files are used as is, while grids read into memory, ie. from
+    a zip, are copied into the staging array so only one is held at once.
+    """
+    sources = []
+    for i, d in enumerate(chunk_dates):
+        r = open_prism(selected[d]['full_path'])
+        if r.grid != grid_of(header):
+            raise ValueError('{p} is not on the same grid as the archive'.format(p=r.path))
+        if isinstance(r.data, np.memmap):
+            sources.append(r.data)
+        else:
+            staging[i] = r.data
+            sources.append(staging[i])
+        del r
+    return sources
+
+class PrismArchive:
+    def __init__(self, archive_path):
+        """A compressed (time, y, x) stack of PRISM grids saved to disk.
+
+        The archive is a single data file of compressed chunks plus an
+        index.json of the dates, grid, and the offset of every chunk. Each
+        chunk holds chunk_size dates for a band of band_rows rows, stored
+        pixel by pixel like a PrismCube, so a pixel's time series only
+        decompresses the chunks of its band. Make a new archive with
+        build_archive.
+
+        Parameters
+        ----------
+        archive_path : str
+            Folder of an archive made with build_archive
+        """
+        _require_numpy()
+        self.path = os.path.abspath(archive_path)
+        with open(os.path.join(self.path, 'index.json')) as f:
+            index = json.load(f)
+
+        self.variable = index['variable']
+        self.type = index['type']
+        self.header = index['header']
+        self.chunk_size = index['chunk_size']
+        self.band_rows = index['band_rows']
+        self.compression = index['compression']
+        self.shuffle = index['shuffle']
+        self.dates = index['dates']
+        # chunks[time chunk][band] = [offset, length]
+        self.chunks = index['chunks']
+        self._date_index = {d:i for i, d in enumerate(self.dates)}
+        self._decompress = COMPRESSORS[self.compression][1]
+
+    @property
+    def shape(self):
+        return (len(self.dates), self.header['NROWS'], self.header['NCOLS'])
+
+    @property
+    def nodata(self):
+        return self.header.get('NODATA')
+
+    def _read_chunk(self, f, chunk_i, band_i):
+        """
+        A single decompressed chunk as (band rows, cols, dates)
+        """
+        offset, length = self.chunks[chunk_i][band_i]
+        f.seek(offset)
+        data = self._decompress(f.read(length))
+
+        n_dates = min(self.chunk_size, len(self.dates) - chunk_i * self.chunk_size)
+        n_rows = min(self.band_rows, self.header['NROWS'] - band_i * self.band_rows)
+        shape = (n_rows, self.header['NCOLS'], n_dates)
+        if self.shuffle:
+            return _unshuffle(data, n_rows * self.header['NCOLS'] * n_dates).reshape(shape)
+        return np.frombuffer(data, dtype='<f4').reshape(shape)
+
+    def series(self, row, col):
+        """
+        The full time series of a single pixel, one value per entry in
+        self.dates.
+        """
+        band_i, band_row = divmod(row, self.band_rows)
+        with open(os.path.join(self.path, 'data.bin'), 'rb') as f:
+            values = [self._read_chunk(f, chunk_i, band_i)[band_row, col]
+                      for chunk_i in range(len(self.chunks))]
+        if len(values) == 0:
+            return np.array([], dtype='<f4')
+        return np.concatenate(values)
+
+    def series_at(self, x, y):
+        """
+        The full time series of the pixel containing longitude x and
+        latitude y.
+        """
+        row, col = xy_to_rowcol(self.header, x, y)
+        if row < 0:
+            raise ValueError('location is outside the grid')
+        return self.series(int(row), int(col))
+
+    def read_date(self, date):
+        """
+        The full grid for a single date, ie. '2016-01-01'
+        """
+        if date not in self._date_index:
+            raise KeyError('date not in archive: ' + str(date))
+        chunk_i, offset = divmod(self._date_index[date], self.chunk_size)
+        with open(os.path.join(self.path, 'data.bin'), 'rb') as f:
+            bands = [self._read_chunk(f, chunk_i, band_i)[:, :, offset]
+                     for band_i in range(len(self.chunks[chunk_i]))]
+        return np.concatenate(bands)
+
+def build_archive(listing,
+                  archive_path,
+                  variable=None,
+                  type=None,
+                  chunk_size=366,
+                  band_rows=8,
+                  compression='zlib',
+                  level=6,
+                  shuffle=True):
+    """Pack many PRISM files into a single compressed archive on disk
+
+    Most of every PRISM grid is NODATA, so the archive is a fraction of the
+    size of the bil files. See PrismArchive for reading it.
+
+    Parameters
+    ----------
+    listing : list
+        Output of prism_iterator
+
+    archive_path : str
+        Folder to create the archive in. It must not exist yet.
+
+    variable : str, optional
+        Only use files for this variable, ie. tmean. Required if the
+        listing has more than one variable.
+
+    type : str, optional
+        Only use files of this type, ie. daily. Required if the listing has
+        more than one type.
+
+    chunk_size : int, optional
+        Dates to store in each chunk, default 366.
+
+    band_rows : int, optional
+        Rows to store in each chunk, default 8.
+
+        Reading a pixel's time series decompresses every chunk of its band,
+        each band_rows * columns * chunk_size values, to use one pixel of
+        each. Reading a date decompresses every band of its time chunk.
+        Smaller band_rows make time series reads faster but compress
+        slightly less. Smaller chunk_size makes both kinds of reads faster,
+        but with more chunks to read and compress.
+
+        Building holds one band of a time chunk in memory at once. Grids
+        from zip files are staged in a temporary file of up to chunk_size
+        grids, so only one is in memory at a time.
+
+    compression : str, optional
+        Either zlib (the default) or lzma. lzma makes smaller archives but
+        is much slower to build and read.
+
+    level : int, optional
+        Compression level, 0-9, default 6.
+
+    shuffle : bool, optional
+        Group the bytes of the float32 values before compressing, which
+        usually makes the archive much smaller. Default True.
+
+    Returns
+    -------
+    PrismArchive
+    """
+    _require_numpy()
+    if compression not in COMPRESSORS:
+        raise ValueError('compression must be one of {c}'.format(c=list(COMPRESSORS)))
+    selected = select_prism_files(listing, variable, type)
+    if len(selected) == 0:
+        raise ValueError('no PRISM files found to build the archive from')
+    dates = sorted(selected)
+    first_file = selected[dates[0]]
+    header = open_prism(first_file['full_path']).header
+    compress = COMPRESSORS[compression][0]
+
+    os.makedirs(archive_path)
+    chunks = []
+    with open(os.path.join(archive_path, 'data.bin'), 'wb') as f, \
+         tempfile.TemporaryFile(dir=archive_path) as staging_file:
+        # only the parts used for zip files take up disk space
+        staging = np.memmap(staging_file, dtype='<f4', mode='w+',
+                            shape=(min(chunk_size, len(dates)), header['NROWS'], header['NCOLS']))
+        for chunk_start in range(0, len(dates), chunk_size):
+            sources = _chunk_sources(selected, dates[chunk_start:chunk_start + chunk_size], header, staging)
+
+            bands = []
+            for row_start in range(0, header['NROWS'], band_rows):
+                row_stop = row_start + band_rows
+                band = np.stack([data[row_start:row_stop] for data in sources], axis=-1).astype('<f4')
+                data = _shuffle(band.reshape(-1)) if shuffle else band.tobytes()
+                compressed = compress(data, level)
+                bands.append([f.tell(), len(compressed)])
+                f.write(compressed)
+            chunks.append(bands)
+            del sources
+        del staging
+
+    index = {'variable'   : first_file['variable'],
+             'type'       : first_file['type'],
+             'header'     : header,
+             'chunk_size' : chunk_size,
+             'band_rows'  : band_rows,
+             'compression': compression,
+             'shuffle'    : shuffle,
+             'dates'      : dates,
+             'chunks'     : chunks}
+    fd, tmp_path = tempfile.mkstemp(dir=archive_path, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(archive_path, 'index.json'))
+
+    return PrismArchive(archive_path)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .base import PrismDaily, PrismMonthly, PrismNormals
+
+async def aiter_prism_downloads(prism, max_concurrency=4):
+    """Download the files for a PrismDaily, PrismMonthly, or PrismNormals
+    object, yielding the path of each bil file as soon as it's extracted.
+
+    Folder listings, transfers, and extraction all run in a pool of
+    max_concurrency threads so the event loop is never blocked. Files are
+    yielded in the order they finish, not in date order. Any file which
+    fails is recorded in prism.failed_downloads and the rest continue.
+
+    Parameters
+    ----------
+    prism : PrismFTP
+        A PrismDaily, PrismMonthly, or PrismNormals object. Its max_workers
+        should be at least max_concurrency so there are enough ftp sessions.
+
+    max_concurrency : int, optional
+        The most listings or downloads to run at once, default 4.
+
+    Yields
+    ------
+    str
+        Full path to a downloaded bil file
+    """
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    pending = {}
+    try:
+        await asyncio.gather(*[loop.run_in_executor(executor, prism._get_folder_index, folder)
+                               for folder in prism._listing_folders()])
+
+        # the plan can still list folders, and scans dest_path with sync=True
+        plan = await loop.run_in_executor(executor, prism._download_plan)
+        prism.failed_downloads = {}
+        for d, url, superseded in plan:
+            task = asyncio.ensure_future(loop.run_in_executor(executor, prism._download_date, d, url, superseded))
+            pending[task] = (d, url)
+
+        while pending:
+            done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                d, url = pending.pop(task)
+                try:
+                    yield task.result()
+                except Exception as e:
+                    prism.failed_downloads[d] = e
+                    print('Failed to download {f}: {e}'.format(f=os.path.basename(url), e=e))
+    finally:
+        # If the caller stops early don't start any more downloads, and
+        # let any already running finish before the ftp sessions are closed.
+        for task in pending:
+            task.cancel()
+        await loop.run_in_executor(None, executor.shutdown)
+
+async def _aiter_product(prism_class, max_concurrency, **kwargs):
+    loop = asyncio.get_event_loop()
+    kwargs.setdefault('max_workers', max_concurrency)
+    prism = await loop.run_in_executor(None, partial(prism_class, **kwargs))
+    downloads = aiter_prism_downloads(prism, max_concurrency=max_concurrency)
+    try:
+        async for bil_path in downloads:
+            yield bil_path
+    finally:
+        # async for doesn't close the inner generator when the caller stops
+        # early, so do it here to wait for running transfers first.
+        await downloads.aclose()
+        prism.close()
+
+def aiter_prism_dailys(variable,
+                       min_date=None,
+                       max_date=None,
+                       dates=None,
+                       max_concurrency=4,
+                       **kwargs):
+    """Download PRISM Daily data, yielding each bil file as it's ready
+
+    Use with ``async for``. Parameters are the same as get_prism_dailys,
+    with max_concurrency setting the most downloads to run at once.
+    """
+    return _aiter_product(PrismDaily, max_concurrency,
+                          variable=variable,
+                          min_date=min_date,
+                          max_date=max_date,
+                          dates=dates,
+                          **kwargs)
+
+def aiter_prism_monthlys(variable,
+                         years=None,
+                         months=None,
+                         dates=None,
+                         max_concurrency=4,
+                         **kwargs):
+    """Download monthly PRISM data, yielding each bil file as it's ready
+
+    Use with ``async for``. Parameters are the same as get_prism_monthlys,
+    with max_concurrency setting the most downloads to run at once.
+    """
+    return _aiter_product(PrismMonthly, max_concurrency,
+                          variable=variable,
+                          years=years,
+                          months=months,
+                          dates=dates,
+                          **kwargs)
+
+def aiter_prism_normals(variable,
+                        resolution,
+                        months=None,
+                        annual=False,
+                        max_concurrency=4,
+                        **kwargs):
+    """Download 30 year normals PRISM data, yielding each bil file as it's ready
+
+    Use with ``async for``. Parameters are the same as get_prism_normals,
+    with max_concurrency setting the most downloads to run at once.
+    """
+    return _aiter_product(PrismNormals, max_concurrency,
+                          variable=variable,
+                          resolution=resolution,
+                          months=months,
+                          annual=annual,
+                          **kwargs)
+
+async def aget_prism_dailys(variable,
+                            min_date=None,
+                            max_date=None,
+                            dates=None,
+                            max_concurrency=4,
+                            **kwargs):
+    """Download PRISM Daily data without blocking the event loop
+
+    Parameters are the same as get_prism_dailys, with max_concurrency
+    setting the most downloads to run at once.
+
+    Returns
+    -------
+    list
+        Full paths to the downloaded bil files
+    """
+    return [f async for f in aiter_prism_dailys(variable, min_date, max_date, dates,
+                                                max_concurrency=max_concurrency, **kwargs)]
+
+async def aget_prism_monthlys(variable,
+                              years=None,
+                              months=None,
+                              dates=None,
+                              max_concurrency=4,
+                              **kwargs):
+    """Download monthly PRISM data without blocking the event loop
+
+    Parameters are the same as get_prism_monthlys, with max_concurrency
+    setting the most downloads to run at once.
+
+    Returns
+    -------
+    list
+        Full paths to the downloaded bil files
+    """
+    return [f async for f in aiter_prism_monthlys(variable, years, months, dates,
+                                                  max_concurrency=max_concurrency, **kwargs)]
+
+async def aget_prism_normals(variable,
+                             resolution,
+                             months=None,
+                             annual=False,
+                             max_concurrency=4,
+                             **kwargs):
+    """Download 30 year normals PRISM data without blocking the event loop
+
+    Parameters are the same as get_prism_normals, with max_concurrency
+    setting the most downloads to run at once.
+
+    Returns
+    -------
+    list
+        Full paths to the downloaded bil files
+    """
+    return [f async for f in aiter_prism_normals(variable, resolution, months, annual,
+                                                 max_concurrency=max_concurrency, **kwargs)]
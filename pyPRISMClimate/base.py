@@ -1,9 +1,99 @@
-from ftplib import FTP
 from datetime import datetime, timedelta
+from ftplib import error_perm
 import os
 import zipfile
-import time
-import urllib.request
+import tempfile
+import threading
+import urllib.parse
+from glob import glob, escape
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .ftp_pool import FTPConnectionPool
+from .listing_cache import ListingCache
+from .retry import RetryPolicy, CircuitOpenError
+from .utils import prism_iterator, prism_md, STATUS_RANK
+
+def index_folder_listing(dir_listing):
+    """
+    Parse a folder listing once into a dictionary keyed by the date portion
+    of each filename, ie. 20160101 or 201601. Each entry is a list of
+    {'filename','status','resolution'} for every file with that date.
+    """
+    index = {}
+    for filename in dir_listing:
+        #    0    1      2     3        4     5
+        # PRISM_tmax_stable_4kmD2_20160101_bil.zip
+        filename_parts = os.path.basename(filename).split('_')
+        if len(filename_parts) < 6:
+            continue
+        
+        resolution = filename_parts[3]
+        if '4km' in resolution:
+            resolution = '4km'
+        elif '800m' in resolution:
+            resolution = '800m'
+        
+        index.setdefault(filename_parts[4], []).append({'filename'  : filename,
+                                                        'status'    : filename_parts[2],
+                                                        'resolution': resolution})
+    return index
+
+def run_downloads(tasks, max_workers):
+    """
+    Run a list of (prism object, date, url, superseded) downloads over a
+    bounded pool of worker threads. Failures are printed and returned as
+    {(prism object, date): exception} instead of stopping the others.
+    """
+    failures = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(prism._download_date, d, url, superseded):(prism, d, url) for prism, d, url, superseded in tasks}
+        for f in as_completed(futures):
+            prism, d, url = futures[f]
+            try:
+                f.result()
+            except Exception as e:
+                failures[(prism, d)] = e
+                print('Failed to download {f}: {e}'.format(f=os.path.basename(url), e=e))
+    
+    if len(failures) > 0:
+        print('{n} of {t} files failed to download'.format(n=len(failures),
+                                                           t=len(tasks)))
+    return failures
+
+class _TrackedBuffer:
+    def __init__(self, buffer, max_size, on_resize):
+        """
+        Wraps a SpooledTemporaryFile being downloaded into, calling
+        on_resize(change) as the bytes it holds in memory change, ie. for
+        every block written by retrbinary. Closing it gives the bytes back.
+        """
+        self.buffer = buffer
+        self.max_size = max_size
+        self.on_resize = on_resize
+        self._in_memory = 0
+    
+    def _resize(self, size):
+        in_memory = min(size, self.max_size)
+        self.on_resize(in_memory - self._in_memory)
+        self._in_memory = in_memory
+    
+    def write(self, data):
+        written = self.buffer.write(data)
+        self._resize(self.buffer.tell())
+        return written
+    
+    def truncate(self, size=None):
+        self.buffer.truncate(size)
+        self._resize(self.buffer.tell() if size is None else size)
+    
+    def tell(self):
+        return self.buffer.tell()
+    
+    def seek(self, *args):
+        return self.buffer.seek(*args)
+    
+    def close(self):
+        self._resize(0)
 
 class PrismFTP:
     def __init__(self, 
@@ -11,42 +101,90 @@ class PrismFTP:
                  user='anonymous', passwd='abc123',
                  dest_path='./',
                  keep_zip=True,
+                 extract=True,
+                 spool_size=64 * 1024 * 1024,
+                 max_workers=1,
+                 listing_cache=None,
+                 retry_policy=None,
+                 sync=False,
+                 session=None,
                  verbose=False):
         self.host=host
         self.user=user
         self.passwd=passwd
-        self._folder_file_lists={}
+        self.session = session
+        if session is None:
+            self._folder_file_lists={}
+            self._folder_indexes={}
+        else:
+            # share listings with every other request in the session
+            self._folder_file_lists = session._folder_file_lists
+            self._folder_indexes = session._folder_indexes
         self.keep_zip = keep_zip
+        self.extract = extract
+        if not (keep_zip or extract):
+            raise ValueError('keep_zip and extract cannot both be False')
+        self.spool_size = spool_size
+        self.sync = sync
         self.verbose = verbose
         
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError('max_workers must be an integer >= 1, got: {w}'.format(w=max_workers))
+        self.max_workers = max_workers
+        self.failed_downloads = {}
+        
+        self.transfer_stats = {'files_downloaded'  : 0,
+                               'bytes_downloaded'  : 0,
+                               'bytes_written'     : 0,
+                               'peak_buffer_bytes' : 0}
+        self._buffer_bytes = 0
+        self._stats_lock = threading.Lock()
+        
+        if isinstance(listing_cache, str):
+            listing_cache = ListingCache(path=listing_cache)
+        self.listing_cache = listing_cache
+        
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        
         self.dest_path = os.path.abspath(dest_path) + '/'
         if not os.path.exists(self.dest_path):
             raise RuntimeError('Path does not exist: '+self.dest_path)
         
         self.connect()
     
-    def _query_ftp_folder(self, folder, attempts_made=0):
-        connect_attempts=5
-        retry_wait_time=300
+    def _query_ftp_folder(self, folder):
+        def query():
+            with self._pool.connection() as con:
+                return con.nlst(folder)
+        
+        # a failed session is dropped by the pool, so each retry will
+        # get a fresh connection.
         try:
-            dir_listing = self.con.nlst(folder)
-            return dir_listing
-        except:
-            if attempts_made + 1 == connect_attempts:
-                raise IOError('Cannot query PRISM ftp')
-            else:
-                print('Cannot query PRISM folder, reconnecting and retrying in {t} sec'.format(t=retry_wait_time))
-                time.sleep(retry_wait_time)
-                self.close()
-                time.sleep(1)
-                self.connect()
-                return self._query_ftp_folder(folder, attempts_made = attempts_made + 1)
+            return self.retry_policy.call(query, description='Query of PRISM folder ' + folder)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise IOError('Cannot query PRISM ftp') from e
     
     def connect(self):
-        self.con = FTP(host=self.host, user=self.user, passwd=self.passwd)
+        """
+        Setup the pool of ftp sessions used for listings and transfers. One
+        session is opened right away so a bad host or login fails here.
+        When part of a PrismSession the session's pool is used instead.
+        """
+        if self.session is not None:
+            self._pool = self.session._pool
+            return
+        self._pool = FTPConnectionPool(host=self.host, user=self.user, passwd=self.passwd,
+                                       max_size=self.max_workers)
+        self._pool.release(self._pool.acquire())
 
     def close(self):
-        self.con.close()
+        # a shared pool is closed by its PrismSession
+        if self.session is None:
+            self._pool.close()
         
     def _validate_variable(self):
         if self.variable not in ['tmean','ppt','tmax','tmin','vpdmin','vpdmax']:
@@ -55,14 +193,23 @@ class PrismFTP:
     def _get_folder_listing(self, folder):
         """
         Querying the ftp takes a few moments, so if a folder is queried once,
-        save the listing for future reference.
+        save the listing for future reference. With a listing_cache the
+        listing is also kept on disk for future sessions.
         """
         if folder in self._folder_file_lists:
             return self._folder_file_lists[folder]
-        else:
+        
+        dir_listing = None
+        if self.listing_cache is not None:
+            dir_listing = self.listing_cache.get(self.host, folder)
+        
+        if dir_listing is None:
             dir_listing = self._query_ftp_folder(folder)
-            self._folder_file_lists[folder]=dir_listing
-            return dir_listing
+            if self.listing_cache is not None:
+                self.listing_cache.set(self.host, folder, dir_listing)
+        
+        self._folder_file_lists[folder]=dir_listing
+        return dir_listing
 
     def _get_date_folder(self, date):
         """
@@ -72,11 +219,24 @@ class PrismFTP:
         year = date.strftime('%Y')
         return self.base_url_dir+'/'+year+'/'
     
-    def _get_date_filename(self, date):
+    def _get_folder_index(self, folder):
+        """
+        The date index of a folder listing, built only once per folder.
+        """
+        if folder not in self._folder_indexes:
+            folder_contents = self._get_folder_listing(folder)
+            self._folder_indexes[folder] = index_folder_listing(folder_contents)
+        return self._folder_indexes[folder]
+    
+    def _get_date_info(self, date):
+        """
+        The filename, status, and resolution for a date, or None if
+        it's not available.
+        """
         folder_to_check = self._get_date_folder(date)
-        folder_contents = self._get_folder_listing(folder_to_check)
+        folder_index = self._get_folder_index(folder_to_check)
         date_str = self._file_search_string(date)
-        matching = [filename for filename in folder_contents if date_str in filename]
+        matching = folder_index.get(date_str, [])
         assert len(matching)<=1, 'More than 1 matching filename in folder'
         
         if len(matching)==0:
@@ -84,61 +244,310 @@ class PrismFTP:
         else:
             return matching[0]
     
-    def _download_file(self, download_path, dest_path, num_attempts=2):
+    def _get_date_filename(self, date):
+        date_info = self._get_date_info(date)
+        if date_info is None:
+            return None
+        else:
+            return date_info['filename']
+    
+    def _download_file(self, download_path, dest_path):
         """
-        Perform the actual download for a single file, with multiple
-        tries if the connection/server is spotty.
+        Perform the actual download for a single file, retrying according
+        to self.retry_policy if the connection/server is spotty.
+        
+        dest_path is either a local path or an open binary file object. 
+        Local paths are written to dest_path + '.part' and only renamed
+        to dest_path once complete. A .part file left by an interrupted
+        download is resumed instead of starting over.
+        """
+        if isinstance(dest_path, str):
+            part_path = dest_path + '.part'
+            with open(part_path, 'ab') as f:
+                self._download_file(download_path, f)
+            os.replace(part_path, dest_path)
+            return
+        
+        remote_path = urllib.parse.urlparse(download_path).path.lstrip('/')
+        def transfer():
+            with self._pool.connection() as con:
+                self._retrieve(con, remote_path, dest_path)
+        
+        self.retry_policy.call(transfer, description='Download of ' + os.path.basename(remote_path))
+    
+    def _retrieve(self, con, remote_path, f):
         """
-        for attempt in range(1,num_attempts+1):
+        RETR a file onto the end of f, using REST to skip the bytes f 
+        already has. If the server refuses the offset start again from 0.
+        """
+        offset = f.tell()
+        if offset > 0:
             try:
-                urllib.request.urlretrieve(download_path, dest_path)
-            except:
-                if attempt==num_attempts:
-                    raise
-                else:
-                    time.sleep(30)
-                    continue
+                con.retrbinary('RETR ' + remote_path, f.write, rest=offset)
+                return
+            except error_perm:
+                f.seek(0)
+                f.truncate()
+        con.retrbinary('RETR ' + remote_path, f.write)
     
     def _local_bil_filename(self, date):
         """
         The final unzipped bil file
         """
-        local_zip = self.dest_path + os.path.basename(self._get_download_url(date))
-        local_bil = local_zip.split('.')[0]+'.bil'
-        return local_bil
+        return self._local_bil_path(self._get_download_url(date))
+    
+    def _local_download_filename(self, date):
+        """
+        The final local file, the zip when extract=False otherwise the bil
+        """
+        url = self._get_download_url(date)
+        if not self.extract:
+            return self.dest_path + os.path.basename(url)
+        return self._local_bil_path(url)
+    
+    def _local_bil_path(self, url):
+        zip_filename = os.path.basename(url)
+        return self.dest_path + zip_filename.split('.')[0] + '.bil'
+        
+    def _download_date(self, date, url, superseded=None):
+        """
+        Download and extract the file for a single date. Any superseded
+        local files are removed once the new one is in place.
+        
+        Returns the path of the extracted bil file, or of the zip file
+        when extract=False.
+        """
+        if self.verbose:
+            print('Downloading ' + os.path.basename(url))
+        
+        local_file = self.dest_path + os.path.basename(url)
+        if not self.extract:
+            self._download_file(download_path = url, 
+                                dest_path = local_file)
+            zip_size = os.path.getsize(local_file)
+            self._update_stats(zip_size, zip_size)
+        elif self.keep_zip:
+            self._download_file(download_path = url, 
+                                dest_path = local_file)
+            zip_size = os.path.getsize(local_file)
+            with zipfile.ZipFile(local_file) as z:
+                extracted_size = self._extract(z)
+            self._update_stats(zip_size, zip_size + extracted_size)
+        else:
+            self._download_streamed(url)
+        
+        if superseded:
+            for file_md in superseded:
+                self._remove_local_files(file_md)
+        
+        if not self.extract:
+            return local_file
+        return self._local_bil_path(url)
+    
+    def _download_streamed(self, url):
+        """
+        Download into a spooled buffer and extract from there, so only
+        the zip members are written to dest_path. The buffer stays in memory
+        up to spool_size bytes, after which it spills to a temporary file.
+        """
+        with tempfile.SpooledTemporaryFile(max_size = self.spool_size) as buffer:
+            # count the buffer as it fills, so buffers of concurrent
+            # transfers all show up in peak_buffer_bytes
+            tracked = _TrackedBuffer(buffer, self.spool_size, self._resize_buffers)
+            try:
+                self._download_file(download_path = url,
+                                    dest_path = tracked)
+                zip_size = buffer.tell()
+                spilled = zip_size if zip_size > self.spool_size else 0
+                
+                buffer.seek(0)
+                with zipfile.ZipFile(buffer) as z:
+                    extracted_size = self._extract(z)
+            finally:
+                tracked.close()
+        
+        self._update_stats(zip_size, spilled + extracted_size)
+    
+    def _resize_buffers(self, change):
+        with self._stats_lock:
+            self._buffer_bytes += change
+            self.transfer_stats['peak_buffer_bytes'] = max(self.transfer_stats['peak_buffer_bytes'],
+                                                           self._buffer_bytes)
+    
+    def _extract(self, z):
+        """
+        Extract all members of a zip to dest_path, returning the bytes written.
+        """
+        z.extractall(path = self.dest_path)
+        return sum(member.file_size for member in z.infolist())
+    
+    def _update_stats(self, bytes_downloaded, bytes_written):
+        with self._stats_lock:
+            self.transfer_stats['files_downloaded'] += 1
+            self.transfer_stats['bytes_downloaded'] += bytes_downloaded
+            self.transfer_stats['bytes_written'] += bytes_written
+    
+    def _remove_local_files(self, file_md):
+        """
+        Remove a local bil or zip file and everything extracted alongside
+        it (hdr, prj, stx, etc.)
+        """
+        stem = os.path.splitext(file_md['full_path'])[0]
+        for f in glob(escape(stem) + '.*'):
+            os.remove(f)
+    
+    def _local_holdings(self):
+        """
+        The PRISM files for this variable already in dest_path, keyed by
+        (type, date, resolution)
+        """
+        holdings = {}
+        for file_md in prism_iterator(self.dest_path, extension = 'bil' if self.extract else 'zip'):
+            if file_md['parsable'] and file_md['variable'] == self.variable:
+                key = (file_md['type'], file_md['date'], file_md['resolution'])
+                holdings.setdefault(key, []).append(file_md)
+        return holdings
+    
+    def _date_resolution(self, date):
+        return self._get_date_info(date)['resolution']
+    
+    def _sync_plan(self, to_download):
+        """
+        Drop any dates where the local file is at least as final as the
+        one on the ftp. Dates which are kept get the local files they will
+        replace attached.
+        """
+        holdings = self._local_holdings()
+        plan = []
+        for d, url in to_download:
+            key = self._local_key(d) + (self._date_resolution(d),)
+            local_files = holdings.get(key, [])
+            remote_rank = STATUS_RANK.get(self.get_date_status(d), -1)
+            
+            if any(STATUS_RANK.get(f['status'], -1) >= remote_rank for f in local_files):
+                if self.verbose:
+                    print('Up to date, skipping ' + os.path.basename(url))
+            else:
+                plan.append((d, url, local_files))
+        return plan
+    
+    def _listing_folders(self):
+        """
+        All ftp folders which need to be listed to find the dates.
+        """
+        return sorted(set(self._get_date_folder(d) for d in self.dates))
+    
+    def _download_plan(self):
+        """
+        A list of (date, url, superseded local files) to download.
+        """
+        # Resolve every url up front so the folder listings are all done
+        # before any transfers start.
+        to_download = [(d, self._get_download_url(d)) for d in self.dates if self.date_available(d)]
         
+        if self.sync:
+            return self._sync_plan(to_download)
+        else:
+            return [(d, url, None) for d, url in to_download]
+    
     def download(self):
         """
         Download the specified files.
+        
+        With max_workers > 1 the transfers and extraction run in a pool of
+        threads. A file which fails after all retries is recorded in
+        self.failed_downloads and the rest of the batch continues.
+        
+        With sync=True only dates missing from dest_path, or where the ftp
+        has a newer status (early -> provisional -> stable), are downloaded.
+        Superseded local files are then removed.
+        
+        With keep_zip=False zips are never written to dest_path, instead
+        they are extracted from a buffer in memory (spilling to a temporary
+        file above spool_size bytes). Totals of bytes downloaded, bytes
+        written to disk, and the peak memory used by buffers are kept in
+        self.transfer_stats.
         """
-        for d in self.dates:
-            if self.date_available(d):
-                url = self._get_download_url(d)
-                local_file = self.dest_path + os.path.basename(url)
-                self._download_file(download_path = url, 
-                                    dest_path = local_file)
-                
-                z = zipfile.ZipFile(local_file)
-                z.extractall(path = self.dest_path)
-                
-                if not self.keep_zip:
-                    os.remove(local_file)
+        to_download = self._download_plan()
+        
+        if self.max_workers == 1:
+            for d, url, superseded in to_download:
+                self._download_date(d, url, superseded)
+        else:
+            self._download_concurrent(to_download)
+        
+        if self.verbose:
+            print('Downloaded {files_downloaded} files, {bytes_downloaded} bytes. '
+                  'Wrote {bytes_written} bytes, peak buffer memory {peak_buffer_bytes} bytes'.format(**self.transfer_stats))
         
         #self.close()
     
+    def _download_concurrent(self, to_download):
+        """
+        Run _download_date over a bounded pool of worker threads.
+        """
+        failures = run_downloads([(self, d, url, superseded) for d, url, superseded in to_download],
+                                 max_workers = self.max_workers)
+        self.failed_downloads = {d:e for (_, d), e in failures.items()}
+    
     def check_downloads(self):
         """
-        Ensures all dates are availalbe
+        Ensures all dates are availalbe. The needed folders are listed 
+        max_workers at a time first. Returns a list of the dates which are
+        not available.
         """
-        date_status = [self.get_date_status(d) for d in self.dates]
-        if all(date_status):
+        self._list_folders(self._listing_folders())
+        missing_dates = [d for d in self.dates if not self.date_available(d)]
+        if len(missing_dates) == 0:
             print('All Dates specified are available')
         else:
-            missing_dates = []
-            for date_i, d in self.dates:
-                if not date_status[date_i]:
-                    missing_dates.append(d.strftime('%Y-%m-%d'))
-            print('The following dates are not available:' + missing_dates)
+            missing_str = [d.strftime('%Y-%m-%d') if isinstance(d, datetime) else d for d in missing_dates]
+            print('The following dates are not available: ' + ', '.join(missing_str))
+        return missing_dates
+    
+    def _list_folders(self, folders):
+        """
+        Index every folder, listing up to max_workers of them at once.
+        """
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            list(executor.map(self._get_folder_index, folders))
+    
+    def remote_years(self):
+        """
+        The year folders available on the ftp for this variable.
+        """
+        folders = [os.path.basename(f.rstrip('/')) for f in self._get_folder_listing(self.base_url_dir)]
+        return sorted(int(f) for f in folders if len(f) == 4 and f.isdigit())
+    
+    def remote_files(self, years=None):
+        """
+        Metadata, as from prism_md, for every file of this variable on the
+        ftp. Every year folder is listed, max_workers at a time, and each
+        filename is parsed once. full_path is the download url. Only files
+        of this product are kept, ie. the annual files in the monthly
+        folders are skipped.
+        
+        years is a list of integer years to list, by default all of them.
+        """
+        if years is None:
+            years = self.remote_years()
+        folders = [self._get_date_folder(datetime(y, 1, 1)) for y in years]
+        self._list_folders(folders)
+        product_type = self.base_url_dir.split('/')[0]
+        
+        listing = []
+        for folder in folders:
+            for filename in self._get_folder_listing(folder):
+                basename = os.path.basename(filename)
+                if not basename.endswith('.zip'):
+                    continue
+                file_md = prism_md(basename)
+                if not file_md['parsable'] or file_md['type'] != product_type:
+                    continue
+                file_md['bil_filename'] = basename.split('.')[0] + '.bil'
+                file_md['full_path'] = 'ftp://' + self.host + '/' + filename
+                listing.append(file_md)
+        return listing
     
     def _get_download_url(self, date):
         """
@@ -154,10 +563,9 @@ class PrismFTP:
         Either stable, provisional, or early. 
         Return None if it's not available. 
         """
-        date_filename = self._get_date_filename(date)
-        if date_filename is not None:
-            status = date_filename.split(sep='_')[-4]
-            return status
+        date_info = self._get_date_info(date)
+        if date_info is not None:
+            return date_info['status']
         else:
             return None
     
@@ -208,6 +616,12 @@ class PrismDaily(PrismFTP):
         For dailies this will be YYYYMMDD
         """
         return date.strftime('%Y%m%d')
+    
+    def _local_key(self, date):
+        """
+        The type and date as parsed by prism_md from a local filename
+        """
+        return ('daily', date.strftime('%Y-%m-%d'))
 
 
 class PrismMonthly(PrismFTP):
@@ -263,6 +677,12 @@ class PrismMonthly(PrismFTP):
         """
         return date.strftime('%Y%m')
     
+    def _local_key(self, date):
+        """
+        The type and date as parsed by prism_md from a local filename
+        """
+        return ('monthly', date.strftime('%Y-%m-01'))
+    
 class PrismNormals(PrismFTP):
     def __init__(self,
                  variable,
@@ -318,6 +738,33 @@ class PrismNormals(PrismFTP):
         """
         return date in ['01','02','03','04','05','06','07','08','09','10','11','12','annual']
     
+    def get_date_status(self, date):
+        """
+        Normals are always stable
+        """
+        if self.date_available(date):
+            return 'stable'
+        else:
+            return None
+    
+    def _date_resolution(self, date):
+        return self.resolution
+    
+    def _listing_folders(self):
+        """
+        Normals urls are built directly, so no folders need listing.
+        """
+        return []
+    
+    def _local_key(self, date):
+        """
+        The type and date as parsed by prism_md from a local filename
+        """
+        if date == 'annual':
+            return ('annual_normals', '2000-01-01')
+        else:
+            return ('monthly_normals', '2000-' + date + '-01')
+    
     def _get_download_url(self, date):
         """
         The full download url
@@ -0,0 +1,228 @@
+import json
+import os
+import sqlite3
+
+from .utils import prism_md, _date_string
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path   TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime  INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    full_path    TEXT PRIMARY KEY,
+    folder       TEXT,
+    filename     TEXT,
+    bil_filename TEXT,
+    variable     TEXT,
+    type         TEXT,
+    resolution   TEXT,
+    status       TEXT,
+    date         TEXT,
+    date_details TEXT,
+    parsable     INTEGER,
+    parse_failue TEXT,
+    size         INTEGER,
+    mtime        INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_variable ON files (variable, type, date);
+CREATE INDEX IF NOT EXISTS files_date ON files (date);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+"""
+
+FILE_COLUMNS = ['full_path', 'folder', 'filename', 'bil_filename', 'variable', 'type',
+                'resolution', 'status', 'date', 'date_details', 'parsable',
+                'parse_failue', 'size', 'mtime']
+
+class PrismCatalog:
+    def __init__(self, db_path, path, recursive=True, extension='bil'):
+        """A persistent catalog of the PRISM files in a folder.
+
+        The metadata of every file is kept in an sqlite database along with
+        its size and modification time, so finding files doesn't need to
+        list folders or parse filenames again. refresh() only lists the
+        folders which changed since the last refresh.
+
+        Parameters
+        ----------
+        db_path : str
+            sqlite database file, made if it doesn't exist
+
+        path : str
+            Folder of PRISM files to catalog
+
+        recursive : boolean
+            If True (default) catalog the full directory tree, otherwise
+            only the folder given.
+
+        extension : str
+            Either bil (the default) or zip, see prism_iterator
+        """
+        if extension not in ['bil','zip']:
+            raise ValueError('extension must be either bil or zip, got: {e}'.format(e=extension))
+        self.path = os.path.abspath(path)
+        self.recursive = recursive
+        self.extension = extension
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def _file_row(self, folder, entry):
+        name = entry.name
+        file_md = prism_md(name)
+        stat = entry.stat()
+        if self.extension == 'zip':
+            bil_filename = name.split('.')[0] + '.bil'
+        else:
+            bil_filename = name
+        return (entry.path, folder, name, bil_filename,
+                file_md['variable'], file_md['type'], file_md['resolution'],
+                file_md['status'], file_md['date'], json.dumps(file_md['date_details']),
+                file_md['parsable'], file_md['parse_failue'],
+                stat.st_size, stat.st_mtime_ns)
+
+    def _scan_folder(self, folder):
+        """
+        List a single folder, updating its files. Files with the same size
+        and modification time as before are kept as is. Returns the sub
+        folders.
+        """
+        known = {row[0]: (row[1], row[2]) for row in
+                 self.db.execute('SELECT full_path, size, mtime FROM files WHERE folder = ?', (folder,))}
+        suffix = '.' + self.extension
+        sub_folders, new_rows, seen = [], [], set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    sub_folders.append(entry.path)
+                    continue
+                if not entry.name.endswith(suffix):
+                    continue
+                seen.add(entry.path)
+                stat = entry.stat()
+                if known.get(entry.path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                new_rows.append(self._file_row(folder, entry))
+
+        removed = [(p,) for p in known if p not in seen]
+        self.db.executemany('DELETE FROM files WHERE full_path = ?', removed)
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES ({c})'.format(c=','.join('?' * len(FILE_COLUMNS))),
+                            new_rows)
+        return sub_folders
+
+    def refresh(self):
+        """Bring the catalog up to date with the files on disk
+
+        Every folder is checked, but only ones with a new modification time,
+        meaning files were added, removed, or renamed, are listed again.
+
+        Returns
+        -------
+        int
+            The number of folders which were listed
+        """
+        known = {row[0]: row[1] for row in self.db.execute('SELECT path, mtime FROM folders')}
+        children = {}
+        for path, parent in self.db.execute('SELECT path, parent FROM folders'):
+            children.setdefault(parent, []).append(path)
+
+        visited, n_scanned = set(), 0
+        to_check = [(self.path, None)]
+        with self.db:
+            while to_check:
+                folder, parent = to_check.pop()
+                try:
+                    mtime = os.stat(folder).st_mtime_ns
+                except OSError:
+                    continue
+                visited.add(folder)
+
+                if known.get(folder) == mtime:
+                    sub_folders = children.get(folder, [])
+                else:
+                    sub_folders = self._scan_folder(folder)
+                    self.db.execute('INSERT OR REPLACE INTO folders VALUES (?, ?, ?)', (folder, parent, mtime))
+                    n_scanned += 1
+
+                if self.recursive:
+                    to_check.extend((f, folder) for f in sub_folders)
+
+            # folders which were deleted, or are no longer under path
+            for folder in set(known) - visited:
+                self.db.execute('DELETE FROM folders WHERE path = ?', (folder,))
+                self.db.execute('DELETE FROM files WHERE folder = ?', (folder,))
+        return n_scanned
+
+    def query(self, variable=None, type=None, status=None, min_date=None, max_date=None, parsable=True):
+        """Find PRISM files in the catalog
+
+        Parameters
+        ----------
+        variable : str or list, optional
+            Only files for these variables, ie. 'tmean' or ['tmin','tmax']
+
+        type : str or list, optional
+            Only files of these types, ie. 'daily' or 'monthly'
+
+        status : str or list, optional
+            Only files with these statuses, ie. 'stable'
+
+        min_date, max_date : str or datetime, optional
+            Only files with dates in this range, inclusive, ie. '2016-01-01'
+
+        parsable : boolean or None, optional
+            If True (the default) only files with a parsable PRISM name,
+            if None every file.
+
+        Returns
+        -------
+        list
+            Metadata of every file found sorted by date, in the same form as
+            the output of prism_iterator
+        """
+        conditions, values = [], []
+        for column, wanted in [('variable', variable), ('type', type), ('status', status)]:
+            if wanted is None:
+                continue
+            wanted = [wanted] if isinstance(wanted, str) else list(wanted)
+            conditions.append('{c} IN ({q})'.format(c=column, q=','.join('?' * len(wanted))))
+            values.extend(wanted)
+        if min_date is not None:
+            conditions.append('date >= ?')
+            values.append(_date_string(min_date))
+        if max_date is not None:
+            conditions.append('date <= ?')
+            values.append(_date_string(max_date))
+        if parsable is not None:
+            conditions.append('parsable = ?')
+            values.append(int(parsable))
+
+        sql = 'SELECT * FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY date, full_path'
+
+        listing = []
+        for row in self.db.execute(sql, values):
+            row = dict(zip(FILE_COLUMNS, row))
+            listing.append({'variable'    : row['variable'],
+                            'type'        : row['type'],
+                            'resolution'  : row['resolution'],
+                            'status'      : row['status'],
+                            'date'        : row['date'],
+                            'date_details': json.loads(row['date_details']),
+                            'parsable'    : bool(row['parsable']),
+                            'parse_failue': row['parse_failue'],
+                            'bil_filename': row['bil_filename'],
+                            'full_path'   : row['full_path']})
+        return listing
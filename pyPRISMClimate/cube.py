@@ -0,0 +1,223 @@
+import json
+import os
+import tempfile
+
+from .raster import np, _require_numpy, open_prism, grid_of, xy_to_rowcol
+from .utils import select_prism_files
+
+class PrismCube:
+    def __init__(self, cube_path):
+        """A (time, y, x) stack of PRISM grids saved to disk.
+
+        The cube is a folder of chunk files, each holding chunk_size dates,
+        plus an index.json of the dates and grid. Within a chunk every pixel's
+        values are stored next to each other, so the full time series of a
+        pixel is a single contiguous read from each chunk. Make a new cube
+        with build_cube.
+
+        Dates after the last full chunk are kept in a tail file one grid
+        after another, so appending a date is a single contiguous write.
+        Once the tail has chunk_size dates it's rearranged into a new
+        chunk.
+
+        Parameters
+        ----------
+        cube_path : str
+            Folder of a cube made with build_cube
+        """
+        _require_numpy()
+        self.path = os.path.abspath(cube_path)
+        with open(os.path.join(self.path, 'index.json')) as f:
+            index = json.load(f)
+
+        self.variable = index['variable']
+        self.type = index['type']
+        self.header = index['header']
+        self.chunk_size = index['chunk_size']
+        self.dates = index['dates']
+        self._date_index = {d:i for i, d in enumerate(self.dates)}
+
+    def _write_index(self):
+        index = {'variable'  : self.variable,
+                 'type'      : self.type,
+                 'header'    : self.header,
+                 'chunk_size': self.chunk_size,
+                 'dates'     : self.dates}
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.path, 'index.json'))
+
+    @property
+    def shape(self):
+        return (len(self.dates), self.header['NROWS'], self.header['NCOLS'])
+
+    @property
+    def nodata(self):
+        return self.header.get('NODATA')
+
+    def _chunk(self, chunk_i, mode='r'):
+        chunk_path = os.path.join(self.path, 'chunk_{i:05d}.dat'.format(i=chunk_i))
+        return np.memmap(chunk_path, dtype='<f4', mode=mode,
+                         shape=(self.header['NROWS'], self.header['NCOLS'], self.chunk_size))
+
+    def _tail(self, mode='r'):
+        tail_path = os.path.join(self.path, 'tail.dat')
+        if mode == 'r+' and not os.path.exists(tail_path):
+            mode = 'w+'
+        return np.memmap(tail_path, dtype='<f4', mode=mode,
+                         shape=(self.chunk_size, self.header['NROWS'], self.header['NCOLS']))
+
+    @property
+    def _n_chunks(self):
+        """
+        The number of full chunks, the rest of the dates are in the tail
+        """
+        return len(self.dates) // self.chunk_size
+
+    def _fold_tail(self, tail, chunk_i, band_rows):
+        """
+        Copy a full tail into a new chunk, band_rows rows at a time.
+        """
+        chunk = self._chunk(chunk_i, mode='w+')
+        for row_start in range(0, self.header['NROWS'], band_rows):
+            row_stop = row_start + band_rows
+            chunk[row_start:row_stop] = np.moveaxis(tail[:, row_start:row_stop], 0, -1)
+        chunk.flush()
+        del chunk
+
+    def append(self, listing, band_rows=8):
+        """Add new dates from prism_iterator output
+
+        Only dates later than the last date in the cube are added, dates
+        already in the cube are skipped. Files are read one at a time.
+
+        Parameters
+        ----------
+        listing : list
+            Output of prism_iterator. It's filtered to the variable and
+            type of the cube.
+
+        band_rows : int, optional
+            Rows of the grid to rearrange at once when the tail becomes a
+            chunk. This uses about 2 * band_rows * columns * chunk_size * 4
+            bytes of memory. Default 8.
+
+        Returns
+        -------
+        int
+            The number of dates added
+        """
+        selected = select_prism_files(listing, self.variable, self.type)
+        new_dates = sorted(d for d in selected if d not in self._date_index)
+        if len(new_dates) == 0:
+            return 0
+        if len(self.dates) > 0 and new_dates[0] < self.dates[-1]:
+            raise ValueError('can only append dates after {last}, got {d}'.format(last=self.dates[-1], d=new_dates[0]))
+
+        tail = self._tail(mode='r+')
+        for d in new_dates:
+            r = open_prism(selected[d]['full_path'])
+            if r.grid != grid_of(self.header):
+                raise ValueError('{p} is not on the same grid as the cube'.format(p=r.path))
+            chunk_i, offset = divmod(len(self.dates), self.chunk_size)
+            tail[offset] = r.data
+            del r
+
+            self._date_index[d] = len(self.dates)
+            self.dates.append(d)
+            if offset == self.chunk_size - 1:
+                tail.flush()
+                self._fold_tail(tail, chunk_i, band_rows)
+                # save the index after every chunk so an interrupted append
+                # keeps what was already written.
+                self._write_index()
+
+        tail.flush()
+        del tail
+        self._write_index()
+        return len(new_dates)
+
+    def series(self, row, col):
+        """
+        The full time series of a single pixel, one value per entry in
+        self.dates.
+        """
+        values = [self._chunk(chunk_i)[row, col] for chunk_i in range(self._n_chunks)]
+        n_tail = len(self.dates) % self.chunk_size
+        if n_tail > 0:
+            values.append(self._tail()[:n_tail, row, col])
+        if len(values) == 0:
+            return np.array([], dtype='<f4')
+        return np.concatenate(values)
+
+    def series_at(self, x, y):
+        """
+        The full time series of the pixel containing longitude x and
+        latitude y.
+        """
+        row, col = xy_to_rowcol(self.header, x, y)
+        if row < 0:
+            raise ValueError('location is outside the grid')
+        return self.series(int(row), int(col))
+
+    def read_date(self, date):
+        """
+        The full grid for a single date, ie. '2016-01-01'
+        """
+        if date not in self._date_index:
+            raise KeyError('date not in cube: ' + str(date))
+        chunk_i, offset = divmod(self._date_index[date], self.chunk_size)
+        if chunk_i < self._n_chunks:
+            return np.array(self._chunk(chunk_i)[:, :, offset])
+        return np.array(self._tail()[offset])
+
+def build_cube(listing, cube_path, variable=None, type=None, chunk_size=366):
+    """Stack many PRISM files into a single (time, y, x) cube on disk
+
+    Parameters
+    ----------
+    listing : list
+        Output of prism_iterator
+
+    cube_path : str
+        Folder to create the cube in. It must not exist yet.
+
+    variable : str, optional
+        Only use files for this variable, ie. tmean. Required if the
+        listing has more than one variable.
+
+    type : str, optional
+        Only use files of this type, ie. daily. Required if the listing has
+        more than one type.
+
+    chunk_size : int, optional
+        Dates to store in each chunk, default 366. A pixel's time series
+        takes one read per chunk, so larger chunks make reads faster. New
+        dates go to the tail until chunk_size of them are there, and the
+        tail is read with one small read per date, so smaller chunks keep
+        reads of recent dates fast.
+
+    Returns
+    -------
+    PrismCube
+    """
+    _require_numpy()
+    selected = select_prism_files(listing, variable, type)
+    if len(selected) == 0:
+        raise ValueError('no PRISM files found to build the cube from')
+    first_file = selected[min(selected)]
+    first_raster = open_prism(first_file['full_path'])
+
+    os.makedirs(cube_path)
+    index = {'variable'  : first_file['variable'],
+             'type'      : first_file['type'],
+             'header'    : first_raster.header,
+             'chunk_size': chunk_size,
+             'dates'     : []}
+    with open(os.path.join(cube_path, 'index.json'), 'w') as f:
+        json.dump(index, f)
+
+    cube = PrismCube(cube_path)
+    cube.append(list(selected.values()))
+    return cube
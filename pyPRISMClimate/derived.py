@@ -0,0 +1,189 @@
+from .raster import np, _require_numpy, open_prism, grid_of
+from .utils import select_prism_files
+
+def join_by_date(listing, variables, type=None):
+    """Pair up the files of several variables by date
+
+    Parameters
+    ----------
+    listing : list
+        Output of prism_iterator
+
+    variables : list of str
+        Variables to join, ie. ['tmin', 'tmax']
+
+    type : str, optional
+        Only use files of this type, ie. daily. Required if the listing has
+        more than one type.
+
+    Returns
+    -------
+    list
+        (date, {variable: metadata}) for every date which has all the
+        variables, sorted by date. When a date has several files for a
+        variable the most final status is used.
+    """
+    selected = {v: select_prism_files(listing, variable=v, type=type) for v in variables}
+    dates = set.intersection(*[set(s) for s in selected.values()]) if len(variables) > 0 else set()
+    return [(d, {v: selected[v][d] for v in variables}) for d in sorted(dates)]
+
+class GrowingDegreeDays:
+    def __init__(self, base=10, cap=30, cumulative=False, start_date=None):
+        """Growing degree days from tmin and tmax
+
+        Both temperatures are first clipped to between base and cap, and
+        the degree days are their mean minus base.
+
+        Parameters
+        ----------
+        base : float, optional
+            Base temperature in C, default 10
+
+        cap : float, optional
+            Upper temperature cutoff in C, default 30
+
+        cumulative : bool, optional
+            Give the running total instead of daily values, default False
+
+        start_date : str, optional
+            Start on this date, ie. '2016-03-01'. Earlier dates are
+            skipped.
+        """
+        self.variables = ['tmin', 'tmax']
+        self.base = base
+        self.cap = cap
+        self.cumulative = cumulative
+        self.start_date = start_date
+        self._total = None
+
+    def __call__(self, date, arrays, out):
+        tmin, tmax = arrays['tmin'], arrays['tmax']
+        np.clip(tmin, self.base, self.cap, out=tmin)
+        np.clip(tmax, self.base, self.cap, out=tmax)
+        np.add(tmin, tmax, out=out)
+        out *= 0.5
+        out -= self.base
+        if self.cumulative:
+            if self._total is None:
+                self._total = np.zeros_like(out)
+            self._total += out
+            out[:] = self._total
+
+class CumulativeSum:
+    def __init__(self, variable, start_date=None):
+        """The running total of a variable, ie. precipitation since March 1
+
+        Parameters
+        ----------
+        variable : str
+            Variable to sum, ie. ppt
+
+        start_date : str, optional
+            Start the total on this date, ie. '2016-03-01'. Earlier dates
+            are skipped.
+        """
+        self.variables = [variable]
+        self.start_date = start_date
+        self._total = None
+
+    def __call__(self, date, arrays, out):
+        values = arrays[self.variables[0]]
+        if self._total is None:
+            self._total = np.zeros_like(values)
+        self._total += values
+        out[:] = self._total
+
+class ThresholdCount:
+    def __init__(self, variable, threshold, below=True, start_date=None):
+        """The running count of days past a threshold, ie. frost days
+
+        Parameters
+        ----------
+        variable : str
+            Variable to check, ie. tmin
+
+        threshold : float
+            Value to compare against, ie. 0 for frost days
+
+        below : bool, optional
+            If True (the default) count days below the threshold, otherwise
+            count days above it.
+
+        start_date : str, optional
+            Start counting on this date, ie. '2016-07-01'. Earlier dates
+            are skipped.
+        """
+        self.variables = [variable]
+        self.threshold = threshold
+        self.below = below
+        self.start_date = start_date
+        self._count = None
+        self._passed = None
+
+    def __call__(self, date, arrays, out):
+        values = arrays[self.variables[0]]
+        if self._count is None:
+            self._count = np.zeros_like(values)
+            self._passed = np.zeros(values.shape, dtype=bool)
+        compare = np.less if self.below else np.greater
+        compare(values, self.threshold, out=self._passed)
+        self._count += self._passed
+        # keep missing data missing
+        np.copyto(out, self._count)
+        np.isnan(values, out=self._passed)
+        np.copyto(out, np.nan, where=self._passed)
+
+def derive_prism(listing, kernel, type=None):
+    """Compute a derived variable for every date of PRISM data
+
+    Files of the variables the kernel needs are joined by date, read into
+    float32 buffers with NODATA as nan, and passed to the kernel. The same
+    buffers are reused for every date so nothing is allocated per file.
+
+    Parameters
+    ----------
+    listing : list
+        Output of prism_iterator with all the variables needed
+
+    kernel : object
+        One of GrowingDegreeDays, CumulativeSum, ThresholdCount, or any
+        object with a variables attribute and a __call__(date, arrays, out)
+        method which writes into out, and optionally a start_date. Kernels
+        with a running total keep it between dates, so use a new kernel for
+        every run.
+
+    type : str, optional
+        Only use files of this type, ie. daily. Required if the listing has
+        more than one type.
+
+    Yields
+    ------
+    tuple
+        (date, grid) in date order. grid is the same array every time, so
+        copy it to keep it past the next date.
+    """
+    _require_numpy()
+    buffers, out, nodata_mask, grid = None, None, None, None
+    start_date = getattr(kernel, 'start_date', None)
+    for date, files in join_by_date(listing, kernel.variables, type=type):
+        if start_date is not None and date < start_date:
+            continue
+
+        rasters = {v: open_prism(f['full_path']) for v, f in files.items()}
+        if buffers is None:
+            header = rasters[kernel.variables[0]].header
+            grid = grid_of(header)
+            buffers = {v: np.empty((header['NROWS'], header['NCOLS']), dtype='f4') for v in kernel.variables}
+            out = np.empty((header['NROWS'], header['NCOLS']), dtype='f4')
+            nodata_mask = np.empty((header['NROWS'], header['NCOLS']), dtype=bool)
+
+        for v, r in rasters.items():
+            if r.grid != grid:
+                raise ValueError('{p} is not on the same grid as the other files'.format(p=r.path))
+            np.copyto(buffers[v], r.data, casting='same_kind')
+            if r.nodata is not None:
+                np.equal(buffers[v], r.nodata, out=nodata_mask)
+                np.copyto(buffers[v], np.nan, where=nodata_mask)
+
+        kernel(date, buffers, out)
+        yield date, out
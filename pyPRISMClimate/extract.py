@@ -0,0 +1,54 @@
+from .raster import np, _require_numpy, open_prism, xy_to_rowcol
+
+def extract_points(listing, lons, lats):
+    """Extract the values at many locations from many PRISM files
+
+    Locations are converted to grid rows and columns only once for every
+    grid geometry, then each file is read with a single vectorized lookup
+    on its memory map. Only the disk pages holding the locations are read.
+
+    Parameters
+    ----------
+    listing : list
+        PRISM files to extract from, ie. the output of prism_iterator
+        filtered to the dates and variables of interest. 
+
+    lons : list or array
+        Longitude of every location
+
+    lats : list or array
+        Latitude of every location
+
+    Returns
+    -------
+    numpy array
+        float32 values with shape (locations, files), where column i
+        matches listing[i]. Locations outside the grid or on NODATA
+        pixels are nan.
+    """
+    _require_numpy()
+    lons = np.asarray(lons, dtype='f8')
+    lats = np.asarray(lats, dtype='f8')
+    if lons.shape != lats.shape or lons.ndim != 1:
+        raise ValueError('lons and lats must be 1 dimensional and the same length')
+
+    values = np.full((len(lons), len(listing)), np.nan, dtype='f4')
+    grid_lookups = {}
+    for file_i, file_md in enumerate(listing):
+        r = open_prism(file_md['full_path'])
+
+        if r.grid not in grid_lookups:
+            rows, cols = xy_to_rowcol(r.header, lons, lats)
+            inside = np.flatnonzero(rows >= 0)
+            flat_index = rows[inside] * r.header['NCOLS'] + cols[inside]
+            # reading in file order keeps the memory map access sequential
+            order = np.argsort(flat_index, kind='stable')
+            grid_lookups[r.grid] = (inside[order], flat_index[order])
+
+        point_index, flat_index = grid_lookups[r.grid]
+        file_values = r.data.reshape(-1)[flat_index].astype('f4')
+        if r.nodata is not None:
+            file_values[file_values == r.nodata] = np.nan
+        values[point_index, file_i] = file_values
+
+    return values
@@ -0,0 +1,100 @@
+from ftplib import FTP, all_errors
+from contextlib import contextmanager
+import threading
+import time
+
+class FTPConnectionPool:
+    def __init__(self,
+                 host,
+                 user,
+                 passwd,
+                 max_size=1,
+                 check_after=15):
+        """
+        A pool of logged in ftp sessions which are reused between transfers.
+
+        Logging in for every file is the slowest part of downloading small
+        files, so sessions are handed back to the pool after each use instead
+        of being closed. Any session idle for more than check_after seconds
+        is checked with a NOOP before being reused, and replaced if the
+        server has dropped it.
+        """
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.max_size = max_size
+        self.check_after = check_after
+
+        self._idle = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._available = threading.BoundedSemaphore(max_size)
+
+    def _new_connection(self):
+        return FTP(host=self.host, user=self.user, passwd=self.passwd)
+
+    def _is_alive(self, con):
+        try:
+            con.voidcmd('NOOP')
+            return True
+        except all_errors:
+            return False
+
+    def _discard(self, con):
+        try:
+            con.close()
+        except all_errors:
+            pass
+
+    def acquire(self):
+        """
+        Borrow a session, blocking if max_size sessions are already in use.
+        """
+        self._available.acquire()
+        try:
+            with self._lock:
+                idle_con = self._idle.pop() if self._idle else None
+
+            if idle_con is not None:
+                con, last_used = idle_con
+                if time.monotonic() - last_used < self.check_after or self._is_alive(con):
+                    return con
+                self._discard(con)
+
+            return self._new_connection()
+        except:
+            self._available.release()
+            raise
+
+    def release(self, con, discard=False):
+        """
+        Return a session to the pool. Sessions which had an error, or which
+        are returned after the pool is closed, are closed instead so they are
+        never handed out again.
+        """
+        if not discard:
+            with self._lock:
+                if not self._closed:
+                    self._idle.append((con, time.monotonic()))
+                    con = None
+        if con is not None:
+            self._discard(con)
+        self._available.release()
+
+    @contextmanager
+    def connection(self):
+        con = self.acquire()
+        try:
+            yield con
+        except:
+            self.release(con, discard=True)
+            raise
+        else:
+            self.release(con)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for con, _ in idle:
+            self._discard(con)
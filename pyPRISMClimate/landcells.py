@@ -0,0 +1,183 @@
+import json
+import os
+
+from .raster import np, _require_numpy, open_prism, grid_of
+
+class LandCells:
+    def __init__(self, header, index):
+        """The valid, non NODATA, pixels of a PRISM grid.
+
+        About half of every PRISM grid is ocean or outside the US border.
+        A LandCells converts grids into 1-D arrays of only the land pixels,
+        and back again, so work on many dates only touches pixels which
+        have data. Get one with land_cells().
+
+        Parameters
+        ----------
+        header : dictionary
+            Header of the grid, see read_hdr
+
+        index : numpy array
+            Flat indexes, in row major order, of the land pixels
+        """
+        self.header = header
+        self.index = index
+
+    @property
+    def shape(self):
+        return (self.header['NROWS'], self.header['NCOLS'])
+
+    @property
+    def grid(self):
+        return grid_of(self.header)
+
+    @property
+    def n_cells(self):
+        return len(self.index)
+
+    @property
+    def mask(self):
+        """
+        A (rows, cols) boolean grid which is True on land pixels
+        """
+        mask = np.zeros(self.shape[0] * self.shape[1], dtype=bool)
+        mask[self.index] = True
+        return mask.reshape(self.shape)
+
+    def compact(self, raster):
+        """
+        The land pixels of a PrismRaster as a 1-D float32 array. Any land
+        pixels which are NODATA are nan.
+        """
+        if raster.grid != self.grid:
+            raise ValueError('{p} is not on the same grid as the land cells'.format(p=raster.path))
+        values = raster.data.reshape(-1)[self.index].astype('f4')
+        if raster.nodata is not None:
+            values[values == raster.nodata] = np.nan
+        return values
+
+    def scatter(self, values, fill=None):
+        """
+        Put 1-D land pixel values, or an array of them with land pixels in
+        the last axis, back into full (rows, cols) grids. Other pixels are
+        set to fill, default nan.
+        """
+        if fill is None:
+            fill = np.nan
+        values = np.asarray(values)
+        if values.shape[-1] != self.n_cells:
+            raise ValueError('expected {n} land cells, got {v}'.format(n=self.n_cells, v=values.shape[-1]))
+        dtype = np.result_type(values.dtype, np.min_scalar_type(fill))
+        grid = np.full(values.shape[:-1] + (self.shape[0] * self.shape[1],), fill, dtype=dtype)
+        grid[..., self.index] = values
+        return grid.reshape(values.shape[:-1] + self.shape)
+
+    def save(self, path):
+        """
+        Save to a .npz file, which can be read with LandCells.load()
+        """
+        np.savez(path, index=self.index, header=np.array(json.dumps(self.header)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(json.loads(str(f['header'])), f['index'])
+
+# One LandCells for each resolution and grid, made from the first file seen
+_land_cells = {}
+
+def land_cells(file_md, cache_dir=None, use_cache=True):
+    """The land pixels for the resolution of a PRISM file
+
+    The valid pixel mask is the same for every date and variable, so it's
+    made only once for each resolution, 4km or 800m, from the first file
+    seen. It's kept in memory, and optionally saved to cache_dir so other
+    sessions can skip reading a grid to make it.
+
+    Parameters
+    ----------
+    file_md : dictionary
+        Metadata of a single PRISM file, ie. an entry of prism_iterator
+
+    cache_dir : str, optional
+        Folder to save and load the land cells in.
+
+    use_cache : bool, optional
+        If False always make the land cells from this file, replacing any
+        saved in cache_dir, and don't keep them in memory. Default True.
+        See also clear_land_cells.
+
+    Returns
+    -------
+    LandCells
+    """
+    _require_numpy()
+    r = open_prism(file_md['full_path'])
+    key = (file_md['resolution'], r.grid)
+
+    cache_path = None
+    if cache_dir is not None:
+        grid_id = '_'.join(str(g) for g in r.grid)
+        cache_path = os.path.join(cache_dir, 'land_cells_{r}_{g}.npz'.format(r=file_md['resolution'], g=grid_id))
+
+    cells = _land_cells.get(key) if use_cache else None
+    if cells is None and use_cache and cache_path is not None and os.path.exists(cache_path):
+        cells = LandCells.load(cache_path)
+    if cells is None:
+        data = r.data.reshape(-1)
+        valid = ~np.isnan(data) if r.nodata is None else data != r.nodata
+        cells = LandCells(r.header, np.flatnonzero(valid).astype('i4'))
+        if cache_path is not None:
+            cells.save(cache_path)
+    elif cache_path is not None and not os.path.exists(cache_path):
+        # made earlier in this session without a cache_dir
+        cells.save(cache_path)
+
+    if use_cache:
+        _land_cells[key] = cells
+    return cells
+
+def clear_land_cells():
+    """
+    Forget the land cells kept in memory by land_cells, ie. after the
+    files they were made from are replaced. Files in a cache_dir are
+    kept.
+    """
+    _land_cells.clear()
+
+def compact_prism(listing, cache_dir=None, use_cache=True):
+    """Read many PRISM files as a 2-D array of only their land pixels
+
+    Parameters
+    ----------
+    listing : list
+        PRISM files to read, ie. the output of prism_iterator filtered to
+        the dates and variables of interest. They must all be the same
+        resolution.
+
+    cache_dir : str, optional
+        Folder to save and load the land cells in, see land_cells.
+
+    use_cache : bool, optional
+        If False make the land cells again from the first file, see
+        land_cells. Default True.
+
+    Returns
+    -------
+    tuple
+        (land cells, values), where values is a float32 array with shape
+        (files, land cells) and row i matches listing[i]. Use
+        LandCells.scatter to make full grids again.
+    """
+    _require_numpy()
+    if len(listing) == 0:
+        raise ValueError('no PRISM files to read')
+    resolutions = set(f['resolution'] for f in listing)
+    if len(resolutions) > 1:
+        raise ValueError('listing has more than one resolution: {r}'.format(r=sorted(resolutions)))
+
+    cells = land_cells(listing[0], cache_dir=cache_dir, use_cache=use_cache)
+    values = np.empty((len(listing), cells.n_cells), dtype='f4')
+    for file_i, file_md in enumerate(listing):
+        values[file_i] = cells.compact(open_prism(file_md['full_path']))
+    return cells, values
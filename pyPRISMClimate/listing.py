@@ -0,0 +1,240 @@
+import os
+
+from .raster import np, _require_numpy
+from .utils import iter_prism_files, SEASON_MONTHS, _date_string
+
+CATEGORY_FIELDS = ['variable', 'type', 'resolution', 'status', 'parse_failue']
+
+def _record_dtype():
+    return np.dtype([('variable', 'i2'),
+                     ('type', 'i1'),
+                     ('resolution', 'i1'),
+                     ('status', 'i1'),
+                     ('parse_failue', 'i1'),
+                     ('date', 'datetime64[D]')])
+
+def _date_details(file_type, d):
+    """
+    Rebuild the date_details entry of prism_md from the type and date
+    """
+    if file_type == 'daily':
+        return {'day':d.day, 'month':d.month, 'year':d.year}
+    elif file_type == 'monthly':
+        return {'month':d.month, 'year':d.year}
+    elif file_type == 'annual':
+        return {'year':d.year}
+    elif file_type == 'seasonal':
+        season = [s for s, months in SEASON_MONTHS.items() if months[0] == d.month][0]
+        return {'season':season, 'year':d.year + 1 if d.month == 12 else d.year}
+    elif file_type == 'monthly_normals':
+        return {'month':d.month}
+    elif file_type == 'annual_normals':
+        return {}
+    return None
+
+class PrismListing:
+    def __init__(self, records, full_paths, categories):
+        """A compact, columnar form of prism_iterator output.
+
+        Each file takes one row of a numpy structured array, with the date
+        as datetime64 and the variable, type, resolution, and status stored
+        as small integer codes into lists of their values. Filtering and
+        sorting work on the whole array at once. Make one with
+        prism_listing() or PrismListing.from_dicts().
+
+        Iterating over a PrismListing gives the same dictionaries as
+        prism_iterator, so it can be used anywhere a listing is expected,
+        and to_dicts() converts it back to a list of them.
+
+        Parameters
+        ----------
+        records : numpy structured array
+            One row per file, with codes for the CATEGORY_FIELDS and the date
+
+        full_paths : numpy object array
+            Path of every file
+
+        categories : dictionary
+            field -> list of values, where a code of i is categories[field][i]
+            and -1 is None
+        """
+        self.records = records
+        self.full_paths = full_paths
+        self.categories = categories
+
+    @classmethod
+    def from_dicts(cls, listing):
+        """
+        Make a PrismListing from prism_iterator output, or any iterable of
+        its dictionaries.
+        """
+        _require_numpy()
+        categories = {f:[] for f in CATEGORY_FIELDS}
+        lookups = {f:{} for f in CATEGORY_FIELDS}
+        rows, full_paths = [], []
+        for file_md in listing:
+            codes = []
+            for field in CATEGORY_FIELDS:
+                value = file_md[field]
+                if value is None:
+                    codes.append(-1)
+                    continue
+                if value not in lookups[field]:
+                    lookups[field][value] = len(categories[field])
+                    categories[field].append(value)
+                codes.append(lookups[field][value])
+            rows.append(tuple(codes) + (file_md['date'] if file_md['date'] is not None else 'NaT',))
+            full_paths.append(file_md['full_path'])
+
+        records = np.array(rows, dtype=_record_dtype())
+        return cls(records, np.array(full_paths, dtype=object), categories)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._to_dict(i)
+
+    def __getitem__(self, key):
+        """
+        An integer gives the dictionary of a single file, anything else, ie.
+        a slice or boolean mask, gives a new PrismListing.
+        """
+        if isinstance(key, (int, np.integer)):
+            return self._to_dict(key)
+        return PrismListing(self.records[key], self.full_paths[key], self.categories)
+
+    def _to_dict(self, i):
+        row = self.records[i]
+        md = {}
+        for field in CATEGORY_FIELDS:
+            code = row[field]
+            md[field] = self.categories[field][code] if code >= 0 else None
+        if np.isnat(row['date']):
+            md['date'] = None
+            md['date_details'] = None
+            md['parsable'] = False
+        else:
+            d = row['date'].item()
+            md['date'] = str(d)
+            md['date_details'] = _date_details(md['type'], d)
+            md['parsable'] = True
+
+        full_path = self.full_paths[i]
+        filename = os.path.basename(full_path)
+        if filename.endswith('.zip'):
+            md['bil_filename'] = filename.split('.')[0] + '.bil'
+        else:
+            md['bil_filename'] = filename
+        md['full_path'] = full_path
+        return md
+
+    def to_dicts(self):
+        """
+        A list of dictionaries, the same as prism_iterator output
+        """
+        return list(self)
+
+    @property
+    def dates(self):
+        return self.records['date']
+
+    def values(self, field):
+        """
+        Every file's value of a category field, ie. values('variable')
+        """
+        lookup = np.array(self.categories[field] + [None], dtype=object)
+        return lookup[self.records[field]]
+
+    def _codes(self, field, wanted):
+        wanted = [wanted] if isinstance(wanted, str) else wanted
+        return [self.categories[field].index(w) for w in wanted if w in self.categories[field]]
+
+    def filter(self, variable=None, type=None, status=None, resolution=None,
+               min_date=None, max_date=None):
+        """Only the files matching all the filters
+
+        Parameters
+        ----------
+        variable, type, status, resolution : str or list, optional
+            Only files with these values, ie. variable=['tmin', 'tmax']
+
+        min_date, max_date : str or datetime, optional
+            Only files with dates in this range, inclusive, ie. '2016-01-01'
+
+        Returns
+        -------
+        PrismListing
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for field, wanted in [('variable', variable), ('type', type),
+                              ('status', status), ('resolution', resolution)]:
+            if wanted is not None:
+                keep &= np.isin(self.records[field], self._codes(field, wanted))
+        if min_date is not None:
+            keep &= self.dates >= np.datetime64(_date_string(min_date), 'D')
+        if max_date is not None:
+            keep &= self.dates <= np.datetime64(_date_string(max_date), 'D')
+        return self[keep]
+
+    def sort_by_date(self):
+        """
+        A copy sorted by date. Files with the same date keep their order.
+        """
+        return self[np.argsort(self.dates, kind='stable')]
+
+    def missing_dates(self, min_date, max_date):
+        """Dates between min_date and max_date with no file
+
+        Parameters
+        ----------
+        min_date, max_date : str or datetime
+            Date range to check, inclusive, ie. '1981-01-01'
+
+        Returns
+        -------
+        numpy datetime64 array
+            Missing days for daily files, or missing months for monthly
+            files. Any other files, ie. annual ones, are ignored.
+        """
+        types = set(self.values('type')) & {'daily', 'monthly'}
+        if types == {'daily', 'monthly'}:
+            raise ValueError('missing_dates needs only daily or only monthly files, found both')
+        elif types == {'monthly'}:
+            unit = 'M'
+        else:
+            unit = 'D'
+        dates = self.filter(type=types.pop()).dates if types else self.dates[:0]
+        expected = np.arange(np.datetime64(_date_string(min_date), unit),
+                             np.datetime64(_date_string(max_date), unit) + 1)
+        return np.setdiff1d(expected, dates.astype('datetime64[' + unit + ']'))
+
+def prism_listing(path, recursive=False, extension='bil', **filters):
+    """Find PRISM files and return them as a compact PrismListing
+
+    Files are found with iter_prism_files, so the dictionary for each file
+    is only kept until it's added to the listing. For very large folders
+    this uses a fraction of the memory of prism_iterator.
+
+    Parameters
+    ----------
+    path : str
+        Path to a folder to search for PRISM files
+
+    recursive : boolean
+        If False (default) only search in the path given, it True
+        then search the full directory tree.
+
+    extension : str
+        Either bil (the default) or zip, see prism_iterator
+
+    filters
+        variable, type, status, min_date, or max_date, see iter_prism_files
+
+    Returns
+    -------
+    PrismListing
+    """
+    return PrismListing.from_dicts(iter_prism_files(path, recursive=recursive,
+                                                    extension=extension, **filters))
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+def default_cache_path():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'pyPRISMClimate', 'ftp_listings.json')
+
+class ListingCache:
+    def __init__(self,
+                 path=None,
+                 stable_ttl=None,
+                 recent_ttl=3600):
+        """Folder listings of the PRISM ftp saved to disk between sessions.
+
+        Parameters
+        ----------
+        path : str, optional
+            json file to store the listings in. Defaults to
+            ~/.cache/pyPRISMClimate/ftp_listings.json
+
+        stable_ttl : int, optional
+            Seconds to keep the listing of a folder where every file is
+            stable. These are past years which PRISM no longer updates, so
+            the default of None keeps them forever.
+
+        recent_ttl : int, optional
+            Seconds to keep the listing of any other folder, ie. the current
+            year which has early and provisional files. Default 3600.
+        """
+        self.path = default_cache_path() if path is None else os.path.abspath(path)
+        self.stable_ttl = stable_ttl
+        self.recent_ttl = recent_ttl
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write(self):
+        cache_dir = os.path.dirname(self.path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+    def _key(self, host, folder):
+        return host + ':' + folder
+
+    def _ttl(self, listing):
+        all_stable = len(listing) > 0 and all('_stable_' in os.path.basename(f) for f in listing)
+        return self.stable_ttl if all_stable else self.recent_ttl
+
+    def get(self, host, folder):
+        """
+        The cached listing for a folder, or None if it's missing or expired.
+        """
+        entry = self._entries.get(self._key(host, folder))
+        if entry is None:
+            return None
+
+        ttl = self._ttl(entry['listing'])
+        if ttl is not None and time.time() - entry['time'] >= ttl:
+            return None
+        return entry['listing']
+
+    def set(self, host, folder, listing):
+        with self._lock:
+            # Re-read first so entries saved by other processes are kept.
+            self._entries = self._read()
+            self._entries[self._key(host, folder)] = {'time': time.time(),
+                                                      'listing': list(listing)}
+            self._write()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._write()
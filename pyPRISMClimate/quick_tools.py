@@ -1,4 +1,5 @@
 from .base import PrismDaily, PrismMonthly, PrismNormals
+from .session import PrismSession
 
 def get_prism_dailys(variable,
                      min_date=None,
@@ -27,8 +28,38 @@ def get_prism_dailys(variable,
         Folder to download to, defaults to the current working directory.
     
     keep_zip : bool, optional
-        Keeps the originally downloaded zip files, default True
+        Keeps the originally downloaded zip files, default True. If False
+        the zip files are extracted from memory and never written to disk.
+    
+    extract : bool, optional
+        Extract the bil files from the zip files, default True. If False
+        only the zip files are kept, which can be read with 
+        pyPRISMClimate.open_prism_zip.
+    
+    max_workers : int, optional
+        Number of files to download and extract at the same time, default 1.
+        When above 1, files which fail to download are reported and
+        returned, and the remaining files are still downloaded.
+    
+    sync : bool, optional
+        Only download files missing from dest_path, or which PRISM has
+        since updated (early -> provisional -> stable). Outdated local
+        files are removed. Default False.
     
+    retry_policy : pyPRISMClimate.RetryPolicy, optional
+        How failed listings and downloads are retried. Defaults to 5 tries
+        with exponential backoff.
+    
+    listing_cache : str or pyPRISMClimate.ListingCache, optional
+        Save the ftp folder listings to disk so later sessions can skip
+        querying the ftp. Either a path to a json file or a ListingCache.
+    
+    Returns
+    -------
+    dictionary
+        Any files which failed to download when max_workers is above 1,
+        keyed by date, ie. datetime(2017,1,1), with the error as the value.
+        Empty if everything downloaded.
     """
     daily = PrismDaily(variable=variable,
                        min_date=min_date,
@@ -37,6 +68,7 @@ def get_prism_dailys(variable,
                        **kwargs)
     daily.download()
     daily.close()
+    return daily.failed_downloads
 
 def get_prism_daily_single(variable,
                            date,
@@ -56,7 +88,8 @@ def get_prism_daily_single(variable,
         Folder to download to, defaults to the current working directory.
 
     return_path : bool, optional
-        Returns the full path to the final bil file, default False
+        Returns the full path to the final bil file, or the zip file when
+        extract=False, default False
     
     keep_zip : bool, optional
         Keeps the originally downloaded zip file, default True
@@ -69,7 +102,7 @@ def get_prism_daily_single(variable,
     daily.close()
     
     if return_path:
-        return daily._local_bil_filename(daily.dates[0])
+        return daily._local_download_filename(daily.dates[0])
     
     
 def get_prism_monthlys(variable,
@@ -99,7 +132,38 @@ def get_prism_monthlys(variable,
         Folder to download to, defaults to the current working directory.
         
     keep_zip : bool, optional
-        Keeps the originally downloaded zip files, default True
+        Keeps the originally downloaded zip files, default True. If False
+        the zip files are extracted from memory and never written to disk.
+    
+    extract : bool, optional
+        Extract the bil files from the zip files, default True. If False
+        only the zip files are kept, which can be read with 
+        pyPRISMClimate.open_prism_zip.
+    
+    max_workers : int, optional
+        Number of files to download and extract at the same time, default 1.
+        When above 1, files which fail to download are reported and
+        returned, and the remaining files are still downloaded.
+    
+    sync : bool, optional
+        Only download files missing from dest_path, or which PRISM has
+        since updated (early -> provisional -> stable). Outdated local
+        files are removed. Default False.
+    
+    retry_policy : pyPRISMClimate.RetryPolicy, optional
+        How failed listings and downloads are retried. Defaults to 5 tries
+        with exponential backoff.
+    
+    listing_cache : str or pyPRISMClimate.ListingCache, optional
+        Save the ftp folder listings to disk so later sessions can skip
+        querying the ftp. Either a path to a json file or a ListingCache.
+    
+    Returns
+    -------
+    dictionary
+        Any files which failed to download when max_workers is above 1,
+        keyed by month, ie. datetime(2017,1,1), with the error as the value.
+        Empty if everything downloaded.
     """
     monthly = PrismMonthly(variable=variable,
                            years=years,
@@ -108,6 +172,7 @@ def get_prism_monthlys(variable,
                            **kwargs)
     monthly.download()
     monthly.close()
+    return monthly.failed_downloads
     
 def get_prism_monthly_single(variable,
                              year=None,
@@ -136,7 +201,8 @@ def get_prism_monthly_single(variable,
         Folder to download to, defaults to the current working directory.
 
     return_path : bool, optional
-        Returns the full path to the final bil file, default False
+        Returns the full path to the final bil file, or the zip file when
+        extract=False, default False
     
     keep_zip : bool, optional
         Keeps the originally downloaded zip file, default True
@@ -153,7 +219,7 @@ def get_prism_monthly_single(variable,
     monthly.close()
     
     if return_path:
-        return monthly._local_bil_filename(monthly.dates[0])
+        return monthly._local_download_filename(monthly.dates[0])
 
 def get_prism_normals(variable,
                       resolution,
@@ -182,7 +248,34 @@ def get_prism_normals(variable,
         Folder to download to, defaults to the current working directory.
     
     keep_zip : bool, optional
-        Keeps the originally downloaded zip files, default True
+        Keeps the originally downloaded zip files, default True. If False
+        the zip files are extracted from memory and never written to disk.
+    
+    extract : bool, optional
+        Extract the bil files from the zip files, default True. If False
+        only the zip files are kept, which can be read with 
+        pyPRISMClimate.open_prism_zip.
+    
+    max_workers : int, optional
+        Number of files to download and extract at the same time, default 1.
+        When above 1, files which fail to download are reported and
+        returned, and the remaining files are still downloaded.
+    
+    sync : bool, optional
+        Only download files missing from dest_path, or which PRISM has
+        since updated (early -> provisional -> stable). Outdated local
+        files are removed. Default False.
+    
+    retry_policy : pyPRISMClimate.RetryPolicy, optional
+        How failed listings and downloads are retried. Defaults to 5 tries
+        with exponential backoff.
+    
+    Returns
+    -------
+    dictionary
+        Any files which failed to download when max_workers is above 1,
+        keyed by month, ie. '01', or 'annual', with the error as the value.
+        Empty if everything downloaded.
     """
     normals = PrismNormals(variable=variable,
                            resolution=resolution,
@@ -191,3 +284,121 @@ def get_prism_normals(variable,
                            **kwargs)
     normals.download()
     normals.close()
+    return normals.failed_downloads
+
+def get_prism_batch(requests,
+                    max_workers=4,
+                    **kwargs):
+    """Download several PRISM variables and products in a single session
+    
+    All requests share the same ftp connections and folder listings, and 
+    their files are downloaded as one batch.
+    
+    Parameters
+    ----------
+    requests : list of dictionaries
+        Each entry has a 'product' of either daily, monthly, or normals,
+        along with the arguments of get_prism_dailys, get_prism_monthlys, 
+        or get_prism_normals. 'variable' can be a list to get several 
+        variables with the same dates. ie. ::
+        
+            [{'product':'daily', 'variable':['tmin','tmax'],
+              'min_date':'2017-01-01', 'max_date':'2017-01-31'},
+             {'product':'normals', 'variable':'ppt', 'resolution':'4km'}]
+    
+    max_workers : int, optional
+        Number of files to download at the same time, default 4.
+    
+    dest_path : str, optional
+        Folder to download to, defaults to the current working directory.
+    
+    keep_zip : bool, optional
+        Keeps the originally downloaded zip files, default True
+    
+    Returns
+    -------
+    dictionary
+        Any files which failed to download, keyed by the ftp folder and 
+        date, ie. ('daily/tmax', datetime(2017,1,1)).
+    """
+    add_functions = {'daily'  : 'add_dailys',
+                     'monthly': 'add_monthlys',
+                     'normals': 'add_normals'}
+    
+    with PrismSession(max_workers=max_workers, **kwargs) as session:
+        for r in requests:
+            r = dict(r)
+            product = r.pop('product')
+            if product not in add_functions:
+                raise ValueError('unknown product: {p}'.format(p=product))
+            
+            variables = r.pop('variable')
+            if isinstance(variables, str):
+                variables = [variables]
+            for v in variables:
+                getattr(session, add_functions[product])(variable=v, **r)
+        
+        session.download()
+    
+    return {(prism.base_url_dir.rstrip('/'), d):e for (prism, d), e in session.failed_downloads.items()}
+
+def get_prism_catalog(variable,
+                      product='daily',
+                      years=None,
+                      max_workers=8,
+                      **kwargs):
+    """Find every PRISM file available on the ftp for a variable
+    
+    Every year folder is listed concurrently and all the filenames are 
+    parsed once, so the status of thousands of dates can be checked with 
+    a single call. This requires numpy, install it with
+    ``pip install pyPRISMClimate[raster]``.
+    
+    Parameters
+    ----------
+    variable : str
+        Either tmean, tmax, tmin, ppt, vpdmin, or vpdmax
+    
+    product : str, optional
+        Either daily (the default) or monthly
+    
+    years : list of int, optional
+        Only list these years. By default every year available is listed.
+    
+    max_workers : int, optional
+        Number of folders to list at the same time, default 8.
+    
+    listing_cache : str or pyPRISMClimate.ListingCache, optional
+        Save the ftp folder listings to disk so later calls can skip
+        querying the ftp.
+    
+    retry_policy : pyPRISMClimate.RetryPolicy, optional
+        How failed listings are retried.
+    
+    Returns
+    -------
+    pyPRISMClimate.PrismListing
+        One row per file with its date and status, where full_path is the
+        download url. ie. to find early or provisional days ::
+        
+            catalog = get_prism_catalog('tmean')
+            not_stable = catalog.filter(status=['early','provisional'])
+            gaps = catalog.missing_dates('1981-01-01', '2020-12-31')
+    """
+    from .listing import PrismListing
+    from .raster import _require_numpy
+    
+    _require_numpy()
+    if product not in ['daily', 'monthly']:
+        raise ValueError('product must be daily or monthly, got: {p}'.format(p=product))
+    
+    if product == 'daily':
+        prism = PrismDaily(variable=variable, min_date=None, max_date=None, dates=[],
+                           max_workers=max_workers, **kwargs)
+    else:
+        prism = PrismMonthly(variable=variable, years=None, months=None, dates=[],
+                             max_workers=max_workers, **kwargs)
+    try:
+        return PrismListing.from_dicts(prism.remote_files(years=years))
+    finally:
+        prism.close()
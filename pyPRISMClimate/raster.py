@@ -0,0 +1,365 @@
+import math
+import os
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('numpy is required for PRISM rasters and listings, install it with: pip install pyPRISMClimate[raster]')
+
+def read_hdr(hdr_path):
+    """Read the header file which accompanies a PRISM bil file
+
+    Parameters
+    ----------
+    hdr_path : str
+        Path to a .hdr file, ie. PRISM_tmax_stable_4kmD2_20160101_bil.hdr
+
+    Returns
+    -------
+    dictionary
+        Every entry of the header with upper case keys. Numeric values are
+        converted to int or float.
+    """
+    with open(hdr_path) as f:
+        return parse_hdr(f.read())
+
+def parse_hdr(hdr_text):
+    """
+    Parse the text of a .hdr file, see read_hdr
+    """
+    header = {}
+    for line in hdr_text.splitlines():
+        line_parts = line.split(None, 1)
+        if len(line_parts) != 2:
+            continue
+        key, value = line_parts[0].upper(), line_parts[1].strip()
+        for convert in (int, float):
+            try:
+                value = convert(value)
+                break
+            except ValueError:
+                pass
+        header[key] = value
+    return header
+
+def header_dtype(header):
+    """
+    The numpy dtype of the pixels described by a header
+    """
+    _require_numpy()
+    nbits = header.get('NBITS', 8)
+    pixel_type = str(header.get('PIXELTYPE', 'SIGNEDINT')).upper()
+    byte_order = '>' if str(header.get('BYTEORDER', 'I')).upper() == 'M' else '<'
+
+    if pixel_type == 'FLOAT':
+        kind = 'f'
+    elif pixel_type == 'UNSIGNEDINT':
+        kind = 'u'
+    else:
+        kind = 'i'
+    return np.dtype('{o}{k}{b}'.format(o=byte_order, k=kind, b=nbits // 8))
+
+def _validate_header(header):
+    for key in ['NROWS', 'NCOLS', 'ULXMAP', 'ULYMAP', 'XDIM', 'YDIM']:
+        if key not in header:
+            raise ValueError('bil header is missing ' + key)
+    if header.get('NBANDS', 1) != 1:
+        raise ValueError('only single band bil files are supported, got NBANDS={n}'.format(n=header['NBANDS']))
+
+def hdr_path_for(bil_path):
+    """
+    The .hdr file alongside a .bil file
+    """
+    return os.path.splitext(bil_path)[0] + '.hdr'
+
+class PrismRaster:
+    def __init__(self, data, header, path=None):
+        """A single PRISM grid along with its georeferencing.
+
+        Parameters
+        ----------
+        data : numpy array
+            The (rows, cols) grid. For open_bil this is a numpy.memmap, so
+            nothing is read from disk until it's indexed.
+
+        header : dictionary
+            The contents of the .hdr file, see read_hdr
+
+        path : str, optional
+            Where the grid was read from
+        """
+        self.data = data
+        self.header = header
+        self.path = path
+
+    @property
+    def shape(self):
+        return (self.header['NROWS'], self.header['NCOLS'])
+
+    @property
+    def nodata(self):
+        return self.header.get('NODATA')
+
+    @property
+    def transform(self):
+        """
+        GDAL style geotransform of the upper left corner and pixel size:
+        (left x, x size, 0, top y, 0, -y size). ULXMAP and ULYMAP in the
+        header are the center of the upper left pixel.
+        """
+        xdim, ydim = self.header['XDIM'], self.header['YDIM']
+        return (self.header['ULXMAP'] - xdim / 2, xdim, 0.0,
+                self.header['ULYMAP'] + ydim / 2, 0.0, -ydim)
+
+    @property
+    def grid(self):
+        """
+        A hashable description of the grid geometry. Rasters with the same
+        grid line up pixel for pixel.
+        """
+        return grid_of(self.header)
+
+    def xy_to_rowcol(self, x, y):
+        """
+        Row and column indexes of the pixels containing longitude x and
+        latitude y. Locations outside the grid get -1.
+        """
+        return xy_to_rowcol(self.header, x, y)
+
+    def subset(self, window=None, bbox=None):
+        """
+        A PrismRaster of only part of the grid, with the header adjusted to
+        match. Nothing is read from disk, and later reads of a memmap subset
+        only touch the bytes of the rows and columns in the window.
+        
+        window is (row start, row stop, col start, col stop), and bbox is
+        (min lon, min lat, max lon, max lat). Set one or the other.
+        """
+        window = self._resolve_window(window, bbox)
+        if window is None:
+            return self
+        row_start, row_stop, col_start, col_stop = window
+        return PrismRaster(self.data[row_start:row_stop, col_start:col_stop],
+                           window_header(self.header, window),
+                           path=self.path)
+
+    def _resolve_window(self, window, bbox):
+        if window is not None and bbox is not None:
+            raise ValueError('set either window or bbox, not both')
+        if bbox is not None:
+            return window_from_bbox(self.header, bbox)
+        if window is not None:
+            return clip_window(self.header, window)
+        return None
+
+    def read(self, masked=False, window=None, bbox=None):
+        """
+        Read the grid into memory. With masked=True NODATA pixels are
+        masked in a numpy masked array. 
+        
+        To read only part of the grid set either window, as (row start, 
+        row stop, col start, col stop), or bbox as (min lon, min lat, 
+        max lon, max lat).
+        """
+        if window is not None or bbox is not None:
+            return self.subset(window=window, bbox=bbox).read(masked=masked)
+        data = np.array(self.data)
+        if masked:
+            return np.ma.masked_equal(data, self.nodata) if self.nodata is not None else np.ma.masked_array(data)
+        return data
+
+def grid_of(header):
+    return (header['NROWS'], header['NCOLS'],
+            header['ULXMAP'], header['ULYMAP'],
+            header['XDIM'], header['YDIM'])
+
+def clip_window(header, window):
+    """
+    Clip a (row start, row stop, col start, col stop) window to the grid
+    """
+    row_start, row_stop, col_start, col_stop = window
+    row_start, row_stop = max(row_start, 0), min(row_stop, header['NROWS'])
+    col_start, col_stop = max(col_start, 0), min(col_stop, header['NCOLS'])
+    if row_start >= row_stop or col_start >= col_stop:
+        raise ValueError('window {w} does not overlap the grid'.format(w=window))
+    return (row_start, row_stop, col_start, col_stop)
+
+def window_from_bbox(header, bbox):
+    """
+    The (row start, row stop, col start, col stop) window of every pixel
+    which overlaps a (min lon, min lat, max lon, max lat) bounding box.
+    """
+    min_x, min_y, max_x, max_y = bbox
+    if min_x >= max_x or min_y >= max_y:
+        raise ValueError('bbox must be (min lon, min lat, max lon, max lat), got {b}'.format(b=bbox))
+    left = header['ULXMAP'] - header['XDIM'] / 2
+    top = header['ULYMAP'] + header['YDIM'] / 2
+    window = (int(math.floor((top - max_y) / header['YDIM'])),
+              int(math.ceil((top - min_y) / header['YDIM'])),
+              int(math.floor((min_x - left) / header['XDIM'])),
+              int(math.ceil((max_x - left) / header['XDIM'])))
+    return clip_window(header, window)
+
+def window_header(header, window):
+    """
+    The header for a window of a grid
+    """
+    row_start, row_stop, col_start, col_stop = window
+    subset_header = dict(header)
+    subset_header['NROWS'] = row_stop - row_start
+    subset_header['NCOLS'] = col_stop - col_start
+    subset_header['ULXMAP'] = header['ULXMAP'] + col_start * header['XDIM']
+    subset_header['ULYMAP'] = header['ULYMAP'] - row_start * header['YDIM']
+    for key in ['BANDROWBYTES', 'TOTALROWBYTES', 'SKIPBYTES']:
+        subset_header.pop(key, None)
+    return subset_header
+
+def xy_to_rowcol(header, x, y):
+    """
+    Row and column indexes of the pixels containing longitude x and latitude
+    y, for a bil header. x and y can be scalars or arrays. Locations outside
+    the grid get -1 for both row and col.
+    """
+    _require_numpy()
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    col = np.floor((x - header['ULXMAP']) / header['XDIM'] + 0.5).astype('i8')
+    row = np.floor((header['ULYMAP'] - y) / header['YDIM'] + 0.5).astype('i8')
+
+    outside = (row < 0) | (row >= header['NROWS']) | (col < 0) | (col >= header['NCOLS'])
+    row = np.where(outside, -1, row)
+    col = np.where(outside, -1, col)
+    return row, col
+
+def open_bil(bil_path, mode='r'):
+    """Open a PRISM bil file without reading it into memory
+
+    The companion .hdr file is parsed and the grid is returned as a numpy
+    memmap, so opening even an 800m grid is nearly instant and only the
+    pixels used are ever read from disk.
+
+    Parameters
+    ----------
+    bil_path : str
+        Path to a .bil file
+
+    mode : str, optional
+        numpy.memmap mode, default 'r' for read only.
+
+    Returns
+    -------
+    PrismRaster
+        With the memmap in .data, and the header and geotransform in
+        .header and .transform
+    """
+    _require_numpy()
+    header = read_hdr(hdr_path_for(bil_path))
+    _validate_header(header)
+    data = np.memmap(bil_path,
+                     dtype=header_dtype(header),
+                     mode=mode,
+                     offset=header.get('SKIPBYTES', 0),
+                     shape=(header['NROWS'], header['NCOLS']))
+    return PrismRaster(data, header, path=bil_path)
+
+def write_bil(bil_path, data, header, nodata=-9999):
+    """Write a grid as a float32 bil file with a matching .hdr file
+
+    Parameters
+    ----------
+    bil_path : str
+        Path of the .bil file to write
+
+    data : numpy array
+        (rows, cols) grid to write. nan values are written as nodata.
+
+    header : dictionary
+        Header of a grid with the same geometry, ie. PrismRaster.header.
+        Only the georeferencing is used from it.
+
+    nodata : float, optional
+        NODATA value to write, default -9999
+    """
+    _require_numpy()
+    data = np.asarray(data, dtype='<f4')
+    if data.shape != (header['NROWS'], header['NCOLS']):
+        raise ValueError('data shape {d} does not match the header'.format(d=data.shape))
+    np.where(np.isnan(data), np.float32(nodata), data).astype('<f4').tofile(bil_path)
+
+    hdr_entries = [('BYTEORDER', 'I'),
+                   ('LAYOUT', 'BIL'),
+                   ('NROWS', header['NROWS']),
+                   ('NCOLS', header['NCOLS']),
+                   ('NBANDS', 1),
+                   ('NBITS', 32),
+                   ('BANDROWBYTES', 4 * header['NCOLS']),
+                   ('TOTALROWBYTES', 4 * header['NCOLS']),
+                   ('PIXELTYPE', 'FLOAT'),
+                   ('ULXMAP', header['ULXMAP']),
+                   ('ULYMAP', header['ULYMAP']),
+                   ('XDIM', header['XDIM']),
+                   ('YDIM', header['YDIM']),
+                   ('NODATA', nodata)]
+    with open(hdr_path_for(bil_path), 'w') as f:
+        for key, value in hdr_entries:
+            f.write('{k:<15}{v}\n'.format(k=key, v=value))
+
+def open_prism_zip(zip_path):
+    """Read a PRISM grid straight out of a downloaded zip file
+
+    The .bil and .hdr members are decompressed in memory, so the zip
+    never needs to be extracted.
+
+    Parameters
+    ----------
+    zip_path : str
+        Path to a PRISM zip, ie. PRISM_tmax_stable_4kmD2_20160101_bil.zip
+
+    Returns
+    -------
+    PrismRaster
+        With the grid as a regular numpy array in .data
+    """
+    _require_numpy()
+    with zipfile.ZipFile(zip_path) as z:
+        members = z.namelist()
+        bil_members = [m for m in members if m.endswith('.bil')]
+        if len(bil_members) != 1:
+            raise ValueError('expected 1 bil file in {z}, found {n}'.format(z=zip_path, n=len(bil_members)))
+        bil_member = bil_members[0]
+        hdr_member = bil_member[:-len('.bil')] + '.hdr'
+        if hdr_member not in members:
+            raise ValueError('no hdr file for {b} in {z}'.format(b=bil_member, z=zip_path))
+
+        header = parse_hdr(z.read(hdr_member).decode('ascii'))
+        _validate_header(header)
+        bil_bytes = z.read(bil_member)
+
+    data = np.frombuffer(bil_bytes,
+                         dtype=header_dtype(header),
+                         count=header['NROWS'] * header['NCOLS'],
+                         offset=header.get('SKIPBYTES', 0))
+    return PrismRaster(data.reshape(header['NROWS'], header['NCOLS']), header, path=zip_path)
+
+def open_prism(path):
+    """Open a PRISM grid from either a .bil file or a downloaded .zip
+
+    Parameters
+    ----------
+    path : str
+        Path to a .bil or .zip file, ie. the full_path entries of
+        prism_iterator
+
+    Returns
+    -------
+    PrismRaster
+    """
+    if path.endswith('.zip'):
+        return open_prism_zip(path)
+    else:
+        return open_bil(path)
@@ -0,0 +1,130 @@
+from ftplib import error_temp, error_reply, error_proto
+import random
+import socket
+import threading
+import time
+
+class CircuitOpenError(IOError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self,
+                 failure_threshold=10,
+                 reset_timeout=60):
+        """Stop calling the server once it's clearly down.
+
+        Parameters
+        ----------
+        failure_threshold : int, optional
+            Consecutive failures, counted over all threads, after which
+            calls fail right away with CircuitOpenError. Default 10.
+
+        reset_timeout : int, optional
+            Seconds to wait before letting calls through again. If the
+            next call also fails the circuit opens for another
+            reset_timeout seconds. Default 60.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError('PRISM ftp appears to be down after {n} consecutive failures'.format(n=self._failures))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+class RetryPolicy:
+    def __init__(self,
+                 max_attempts=5,
+                 backoff_base=2,
+                 backoff_cap=300,
+                 jitter=True,
+                 retryable=(ConnectionError, socket.timeout, TimeoutError, EOFError,
+                            error_temp, error_reply, error_proto),
+                 circuit_breaker=None):
+        """How ftp listings and transfers are retried.
+
+        Parameters
+        ----------
+        max_attempts : int, optional
+            Total tries for a single listing or file, default 5.
+
+        backoff_base : float, optional
+            Seconds to wait after the first failure. This doubles after
+            every failure, default 2.
+
+        backoff_cap : float, optional
+            The most seconds to ever wait between tries, default 300.
+
+        jitter : bool, optional
+            Wait a random time between 0 and the backoff instead of the
+            full backoff, so many parallel jobs don't retry in lockstep.
+            Default True.
+
+        retryable : tuple of exceptions, optional
+            Errors worth trying again. Anything else, such as a permanent
+            ftp error for a missing file or a local disk error, is raised
+            right away. Defaults to connection, timeout, and temporary ftp
+            errors.
+
+        circuit_breaker : CircuitBreaker, optional
+            Shared breaker which fails fast when the server is down. Defaults
+            to a new CircuitBreaker(), use False to disable.
+        """
+        if max_attempts < 1:
+            raise ValueError('max_attempts must be >= 1, got: {m}'.format(m=max_attempts))
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.jitter = jitter
+        self.retryable = retryable
+
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+        self.circuit_breaker = circuit_breaker
+
+    def wait_time(self, attempt):
+        """
+        Seconds to wait after the given (1 based) failed attempt.
+        """
+        backoff = min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1))
+        if self.jitter:
+            return random.uniform(0, backoff)
+        else:
+            return backoff
+
+    def call(self, func, description='PRISM ftp request'):
+        """
+        Call func() until it succeeds, raising the last error once
+        max_attempts is used up.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            if self.circuit_breaker:
+                self.circuit_breaker.before_call()
+            try:
+                result = func()
+            except self.retryable as e:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_failure()
+                if attempt == self.max_attempts:
+                    raise
+                wait = self.wait_time(attempt)
+                print('{d} failed ({e}), retrying in {t:.1f} sec'.format(d=description, e=e, t=wait))
+                time.sleep(wait)
+            else:
+                if self.circuit_breaker:
+                    self.circuit_breaker.record_success()
+                return result
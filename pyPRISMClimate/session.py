@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import PrismDaily, PrismMonthly, PrismNormals, run_downloads
+from .ftp_pool import FTPConnectionPool
+from .listing_cache import ListingCache
+from .retry import RetryPolicy
+
+class PrismSession:
+    def __init__(self,
+                 host='prism.nacse.org',
+                 user='anonymous', passwd='abc123',
+                 max_workers=4,
+                 **kwargs):
+        """Download several variables and products over shared ftp sessions.
+
+        Every request added to the session uses the same pool of ftp
+        sessions and the same folder listings, and download() runs all of
+        them as a single plan over max_workers threads.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Number of files to download at the same time, and the number of
+            ftp sessions to open, default 4.
+
+        kwargs
+            Any other PrismFTP options, ie. dest_path, keep_zip, sync,
+            listing_cache, or retry_policy. These are the defaults for every
+            request and can be overridden in add_dailys() etc. max_workers
+            and the ftp login can only be set here.
+        """
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.max_workers = max_workers
+        if isinstance(kwargs.get('listing_cache'), str):
+            kwargs['listing_cache'] = ListingCache(path=kwargs['listing_cache'])
+        # one retry policy, and so one circuit breaker, for the whole session
+        kwargs.setdefault('retry_policy', RetryPolicy())
+        self.request_kwargs = kwargs
+        self.requests = []
+        self.failed_downloads = {}
+
+        self._folder_file_lists = {}
+        self._folder_indexes = {}
+        self._pool = FTPConnectionPool(host=host, user=user, passwd=passwd,
+                                       max_size=max_workers)
+        self._pool.release(self._pool.acquire())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _add(self, prism_class, **kwargs):
+        for option in ['max_workers', 'host', 'user', 'passwd', 'session']:
+            if option in kwargs:
+                raise ValueError('{o} is shared by every request, set it in PrismSession() instead'.format(o=option))
+        request_kwargs = dict(self.request_kwargs)
+        request_kwargs.update(kwargs)
+        prism = prism_class(host=self.host, user=self.user, passwd=self.passwd,
+                            max_workers=self.max_workers,
+                            session=self,
+                            **request_kwargs)
+        self.requests.append(prism)
+        return prism
+
+    def add_dailys(self, variable, min_date=None, max_date=None, dates=None, **kwargs):
+        """
+        Add daily data to the session, see get_prism_dailys
+        """
+        return self._add(PrismDaily, variable=variable, min_date=min_date,
+                         max_date=max_date, dates=dates, **kwargs)
+
+    def add_monthlys(self, variable, years=None, months=None, dates=None, **kwargs):
+        """
+        Add monthly data to the session, see get_prism_monthlys
+        """
+        return self._add(PrismMonthly, variable=variable, years=years,
+                         months=months, dates=dates, **kwargs)
+
+    def add_normals(self, variable, resolution, months=None, annual=False, **kwargs):
+        """
+        Add 30 year normals to the session, see get_prism_normals
+        """
+        return self._add(PrismNormals, variable=variable, resolution=resolution,
+                         months=months, annual=annual, **kwargs)
+
+    def plan(self):
+        """
+        A list of (request, date, url, superseded) for every file to
+        download. All the needed folders are listed concurrently first.
+        """
+        folder_requests = {}
+        for prism in self.requests:
+            for folder in prism._listing_folders():
+                folder_requests.setdefault(folder, prism)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(lambda item: item[1]._get_folder_index(item[0]), folder_requests.items()))
+
+        return [(prism, d, url, superseded) for prism in self.requests
+                for d, url, superseded in prism._download_plan()]
+
+    def download(self):
+        """
+        Download everything added to the session. Files which fail are
+        recorded in self.failed_downloads, keyed by (request, date), and
+        also in the failed_downloads of each request.
+        """
+        failures = run_downloads(self.plan(), max_workers=self.max_workers)
+        for prism in self.requests:
+            prism.failed_downloads = {d:e for (p, d), e in failures.items() if p is prism}
+        self.failed_downloads = failures
+
+    def close(self):
+        self._pool.close()
@@ -1,8 +1,30 @@
-from datetime import datetime
+from datetime import datetime, date
 import os
 from glob import glob
+import re
 from re import match
 
+# Files get upgraded from early -> provisional -> stable as PRISM
+# revises them.
+STATUS_RANK = {'early':0, 'provisional':1, 'stable':2}
+
+# Seasons are named by the year of their last month, so
+# December 2015 is in DJF 2016.
+SEASON_MONTHS = {'DJF':(12,1,2),
+                 'MAM':(3,4,5),
+                 'JJA':(6,7,8),
+                 'SON':(9,10,11)}
+
+# Daily, monthly, annual, and seasonal names in a single pass. Anything
+# else, ie. normals or bad dates, goes through the full parser.
+#         PRISM    tmax     stable   4kmD2      20160101 / 201601 / 2016 / 2016DJF    bil    .zip
+PRISM_NAME = re.compile(r'^[^._]*_([^._]*)_([^._]*)_[^._]*_'
+                        r'(?:(\d{4})(\d{2})(\d{2})|(\d{4})(\d{2})|(\d{4})(DJF|MAM|JJA|SON)|(\d{4}))'
+                        r'_[^._]*(?:\.|\Z)', flags=re.ASCII)
+
+MD_KEYS = ['variable', 'type', 'resolution', 'status', 'date',
+           'date_details', 'parsable', 'parse_failue']
+
 def prism_md(filename):
     """Extract metdata from a PRISM filename
     
@@ -23,6 +45,58 @@ def prism_md(filename):
                      'year':2017'}
      }
     """
+    if 'PRISM' in filename and 'normal' not in filename:
+        m = PRISM_NAME.match(filename)
+        if m is not None:
+            try:
+                return _fast_prism_md(filename, m)
+            except ValueError:
+                # ie. Feb 30, the full parser gives the same failure
+                pass
+    return _full_prism_md(filename)
+
+def _fast_prism_md(filename, m):
+    """
+    Metadata from a match of PRISM_NAME, the same as _full_prism_md
+    """
+    file_type, date_str, date_details = _match_date(m.groups()[2:])
+    return {'variable':m.group(1),
+            'type':file_type,
+            'resolution':_resolution(filename),
+            'status':m.group(2),
+            'date':date_str,
+            'date_details':date_details,
+            'parsable':True,
+            'parse_failue':None}
+
+def _match_date(date_groups):
+    """
+    The type, date string, and date_details from the date groups of a
+    PRISM_NAME match. Raises ValueError for dates which don't exist.
+    """
+    day_year, day_month, day, month_year, month, season_year, season, year = date_groups
+    if day_year is not None:
+        d = date(int(day_year), int(day_month), int(day))
+        return 'daily', str(d), {'day':d.day, 'month':d.month, 'year':d.year}
+    elif month_year is not None:
+        d = date(int(month_year), int(month), 1)
+        return 'monthly', str(d), {'month':d.month, 'year':d.year}
+    elif year is not None:
+        d = date(int(year), 1, 1)
+        return 'annual', str(d), {'year':d.year}
+    else:
+        first_month = SEASON_MONTHS[season][0]
+        d = date(int(season_year) - 1 if first_month == 12 else int(season_year), first_month, 1)
+        return 'seasonal', str(d), {'season':season, 'year':int(season_year)}
+
+def _resolution(filename):
+    if '4km' in filename:
+        return '4km'
+    elif '800m' in filename:
+        return '800m'
+    return None
+
+def _full_prism_md(filename):
     md = {'variable':None,
           'type':None,
           'resolution':None,
@@ -90,6 +164,33 @@ def prism_md(filename):
         except:
             pass
     
+    # annual? ie. PRISM_ppt_stable_4kmM3_2015_bil
+    if not date_parsed:
+        try:
+            if len(filename_parts[4]) != 4:
+                raise ValueError()
+            d = datetime.strptime(filename_parts[4], '%Y')
+            md['type'] = 'annual'
+            date_parsed = True
+        except:
+            pass
+    
+    # seasonal? ie. PRISM_tmean-mean_stable_4kmA_2016DJF_bil 
+    # The date is the first day of the season, so December of the 
+    # prior year for DJF.
+    if not date_parsed:
+        try:
+            season = filename_parts[4][4:]
+            if len(filename_parts[4]) != 7 or season not in SEASON_MONTHS:
+                raise ValueError()
+            season_year = datetime.strptime(filename_parts[4][:4], '%Y').year
+            first_month = SEASON_MONTHS[season][0]
+            d = datetime(season_year - 1 if first_month == 12 else season_year, first_month, 1)
+            md['type'] = 'seasonal'
+            date_parsed = True
+        except:
+            pass
+    
     # monthly normals?
     # insert the year 2000 here because it should be something instead of nothing.
     if not date_parsed:
@@ -135,6 +236,11 @@ def prism_md(filename):
     elif md['type']=='monthly':
         md['date_details'] = {'month': d.month,
                               'year' : d.year}
+    elif md['type']=='annual':
+        md['date_details'] = {'year' : d.year}
+    elif md['type']=='seasonal':
+        md['date_details'] = {'season': season,
+                              'year'  : season_year}
     elif md['type']=='monthly_normals':
         md['date_details'] = {'month': d.month}
     elif md['type']=='annual_normals':
@@ -143,7 +249,58 @@ def prism_md(filename):
     md['parsable'] = True
     return md
 
-def prism_iterator(path, recursive=False):
+def prism_md_batch(filenames):
+    """Extract metadata from many PRISM filenames at once
+
+    Parameters
+    ----------
+    filenames : list of str
+        PRISM filenames, ie. PRISM_tmax_stable_4kmM2_201601_bil.zip
+
+    Returns
+    -------
+    dictionary of lists
+        The same entries as prism_md, but as columns with one value per
+        filename, ie. {'variable':['tmax', ...], 'date':['2016-01-01', ...]}
+    """
+    columns = {k:[] for k in MD_KEYS}
+    appends = [(columns[k].append, k) for k in MD_KEYS]
+    (add_variable, add_type, add_resolution, add_status,
+     add_date, add_date_details, add_parsable, add_parse_failue) = [a for a, k in appends]
+
+    # Names usually repeat the same dates for every variable, so each date
+    # is only checked once. None marks dates which don't exist.
+    known_dates = {}
+    match = PRISM_NAME.match
+    for filename in filenames:
+        m = match(filename) if 'PRISM' in filename and 'normal' not in filename else None
+        if m is not None:
+            groups = m.groups()
+            date_groups = groups[2:]
+            if date_groups not in known_dates:
+                try:
+                    known_dates[date_groups] = _match_date(date_groups)
+                except ValueError:
+                    known_dates[date_groups] = None
+            parsed = known_dates[date_groups]
+        if m is None or parsed is None:
+            md = _full_prism_md(filename)
+            for append, k in appends:
+                append(md[k])
+            continue
+
+        file_type, date_str, date_details = parsed
+        add_variable(groups[0])
+        add_type(file_type)
+        add_resolution(_resolution(filename))
+        add_status(groups[1])
+        add_date(date_str)
+        add_date_details(dict(date_details))
+        add_parsable(True)
+        add_parse_failue(None)
+    return columns
+
+def prism_iterator(path, recursive=False, extension='bil'):
     """Returns a list of metadata for all PRISM bil files located in path
     
     Parameters
@@ -155,6 +312,12 @@ def prism_iterator(path, recursive=False):
         If False (default) only search in the path given, it True
         then search the full directory tree. The metadata returned
         will include the full path of each file regardless.
+    
+    extension : str
+        Either bil (the default) to find extracted bil files, or zip to
+        find the original PRISM zip files, ie. ones downloaded with
+        extract=False. For zips full_path is the zip file and bil_filename
+        is the name of the bil file inside it.
 
     Returns
     -------
@@ -162,19 +325,192 @@ def prism_iterator(path, recursive=False):
         List of dictionaries where each entry contains metadata for a single 
         PRISM bil file.
     """
+    if extension not in ['bil','zip']:
+        raise ValueError('extension must be either bil or zip, got: {e}'.format(e=extension))
+    
     dir_listing = glob('{p}{s}**'.format(p=path,s=os.sep),
                        recursive=recursive)
     
-    bil_file_paths = [f for f in dir_listing if match('^\S*\.bil$',f)]
+    bil_file_paths = [f for f in dir_listing if match(r'^\S*\.' + extension + '$',f)]
     
     listing = []
     for file_path in bil_file_paths:
         filename = os.path.basename(file_path)
         file_md = prism_md(filename)
-        file_md['bil_filename'] = filename
+        if extension == 'zip':
+            file_md['bil_filename'] = filename.split('.')[0] + '.bil'
+        else:
+            file_md['bil_filename'] = filename
         file_md['full_path'] = file_path
         
         listing.append(file_md)
     
     return listing
-    
+
+def _date_string(d):
+    """
+    YYYY-MM-DD string of a date given as a string, date, or datetime
+    """
+    if d is None or isinstance(d, str):
+        return d
+    return str(d)[:10]
+
+def _filename_date(filename_parts):
+    """
+    The type and YYYY-MM-DD date from the date part of a split PRISM
+    filename, ie. 20160101, 201601, 2016, or 2016DJF, without checking the
+    date exists. None for anything else, ie. normals.
+    """
+    token = filename_parts[4]
+    year = token[:4]
+    if not (token.isascii() and year.isdigit()):
+        return None
+    if len(token) == 8 and token.isdigit():
+        return 'daily', year + '-' + token[4:6] + '-' + token[6:]
+    elif len(token) == 6 and token.isdigit():
+        return 'monthly', year + '-' + token[4:] + '-01'
+    elif len(token) == 4:
+        return 'annual', year + '-01-01'
+    elif len(token) == 7 and token[4:] in SEASON_MONTHS:
+        first_month = SEASON_MONTHS[token[4:]][0]
+        first_year = int(year) - 1 if first_month == 12 else int(year)
+        return 'seasonal', '{y:04d}-{m:02d}-01'.format(y=first_year, m=first_month)
+    return None
+
+def iter_prism_files(path, recursive=False, extension='bil',
+                     variable=None, type=None, status=None,
+                     min_date=None, max_date=None):
+    """Lazily find PRISM files, yielding metadata as they are found
+
+    Like prism_iterator, but folders are walked with os.scandir and each
+    file's metadata is yielded as soon as it's found, so nothing is held
+    in memory and the first results are available right away. The filters,
+    including the type and dates, are checked against the filename before
+    the full metadata is made, so files which don't match cost very little.
+
+    Parameters
+    ----------
+    path : str
+        Path to a folder to search for PRISM files
+
+    recursive : boolean
+        If False (default) only search in the path given, it True
+        then search the full directory tree.
+
+    extension : str
+        Either bil (the default) or zip, see prism_iterator
+
+    variable : str or list, optional
+        Only files for these variables, ie. 'tmean' or ['tmin','tmax']
+
+    type : str or list, optional
+        Only files of these types, ie. 'daily' or 'monthly'
+
+    status : str or list, optional
+        Only files with these statuses, ie. 'stable'
+
+    min_date, max_date : str or datetime, optional
+        Only files with dates in this range, inclusive, ie. '2016-01-01'.
+        Compared to the date entry of the metadata.
+
+    Yields
+    ------
+    dictionary
+        Metadata for a single PRISM file, the same as the entries of
+        prism_iterator
+    """
+    if extension not in ['bil','zip']:
+        raise ValueError('extension must be either bil or zip, got: {e}'.format(e=extension))
+    suffix = '.' + extension
+    variables = [variable] if isinstance(variable, str) else variable
+    types = [type] if isinstance(type, str) else type
+    statuses = [status] if isinstance(status, str) else status
+    min_date, max_date = _date_string(min_date), _date_string(max_date)
+    date_filtering = types is not None or min_date is not None or max_date is not None
+    filtering = date_filtering or variables is not None or statuses is not None
+
+    folders = [path]
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                name = entry.name
+                if recursive and entry.is_dir():
+                    folders.append(entry.path)
+                    continue
+                if not name.endswith(suffix):
+                    continue
+
+                # cheap checks on the filename before parsing it
+                name_date = None
+                if filtering:
+                    filename_parts = name.split('.')[0].split('_')
+                    if len(filename_parts) < 3:
+                        continue
+                    if variables is not None and filename_parts[1] not in variables:
+                        continue
+                    if statuses is not None and 'normal' not in name and filename_parts[2] not in statuses:
+                        continue
+                    if date_filtering and len(filename_parts) == 6 and 'normal' not in name:
+                        name_date = _filename_date(filename_parts)
+                    if name_date is not None:
+                        file_type, date_str = name_date
+                        if types is not None and file_type not in types:
+                            continue
+                        if min_date is not None and date_str < min_date:
+                            continue
+                        if max_date is not None and date_str > max_date:
+                            continue
+
+                file_md = prism_md(name)
+                if name_date is not None:
+                    # everything was checked above, unless the date doesn't
+                    # exist, ie. Feb 30
+                    if file_md['date'] != name_date[1]:
+                        continue
+                else:
+                    # normals and unusual names
+                    if variables is not None and file_md['variable'] not in variables:
+                        continue
+                    if types is not None and file_md['type'] not in types:
+                        continue
+                    if statuses is not None and file_md['status'] not in statuses:
+                        continue
+                    if min_date is not None and (file_md['date'] is None or file_md['date'] < min_date):
+                        continue
+                    if max_date is not None and (file_md['date'] is None or file_md['date'] > max_date):
+                        continue
+
+                if extension == 'zip':
+                    file_md['bil_filename'] = name.split('.')[0] + '.bil'
+                else:
+                    file_md['bil_filename'] = name
+                file_md['full_path'] = entry.path
+                yield file_md
+
+def select_prism_files(listing, variable=None, type=None):
+    """
+    Filter prism_iterator output to a single variable and type, keeping only
+    the most final status when a date has several files. Returns a
+    dictionary of date string -> metadata.
+    """
+    selected = {}
+    for file_md in listing:
+        if not file_md['parsable']:
+            continue
+        if variable is not None and file_md['variable'] != variable:
+            continue
+        if type is not None and file_md['type'] != type:
+            continue
+
+        current = selected.get(file_md['date'])
+        if current is None or STATUS_RANK.get(file_md['status'], -1) > STATUS_RANK.get(current['status'], -1):
+            selected[file_md['date']] = file_md
+
+    found = set((f['variable'], f['type']) for f in selected.values())
+    if len(found) > 1:
+        raise ValueError('listing has several variables or types, set variable and type: ' + str(sorted(found)))
+    return selected
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+
+from .raster import np, _require_numpy, open_prism, grid_of
+
+ZONAL_STATS = ['mean', 'sum', 'min', 'max', 'count']
+
+def _polygon_rings(polygon):
+    """
+    A polygon can be a single ring of (x, y) points, or a list of rings
+    where any inside others are holes.
+    """
+    if len(polygon) > 0 and np.ndim(polygon[0]) == 1:
+        return [polygon]
+    return polygon
+
+def rasterize_zones(header, zones):
+    """Label every pixel of a grid with the zone it's in
+
+    A pixel is in a zone when its center is inside the zone's polygon,
+    using the even-odd rule so inner rings are holes.
+
+    Parameters
+    ----------
+    header : dictionary
+        Header of the grid, ie. PrismRaster.header
+
+    zones : dictionary
+        zone name -> polygon, where a polygon is a list of (longitude,
+        latitude) points, or a list of several such rings. When zones
+        overlap a pixel goes to the last one.
+
+    Returns
+    -------
+    numpy array
+        (rows, cols) int32 zone numbers, in the order of zones, with -1 for
+        pixels outside every zone.
+    """
+    _require_numpy()
+    nrows, ncols = header['NROWS'], header['NCOLS']
+    xdim, ydim = header['XDIM'], header['YDIM']
+    x_centers = header['ULXMAP'] + xdim * np.arange(ncols)
+    y_centers = header['ULYMAP'] - ydim * np.arange(nrows)
+    labels = np.full((nrows, ncols), -1, dtype='i4')
+
+    for zone_i, polygon in enumerate(zones.values()):
+        rings = [np.asarray(r, dtype='f8') for r in _polygon_rings(polygon)]
+        all_points = np.concatenate(rings)
+        # only test the pixels in the bounding box of the zone
+        col_start = np.searchsorted(x_centers, all_points[:, 0].min(), side='left')
+        col_stop = np.searchsorted(x_centers, all_points[:, 0].max(), side='right')
+        row_start = np.searchsorted(-y_centers, -all_points[:, 1].max(), side='left')
+        row_stop = np.searchsorted(-y_centers, -all_points[:, 1].min(), side='right')
+        if col_start >= col_stop or row_start >= row_stop:
+            continue
+
+        x, y = np.meshgrid(x_centers[col_start:col_stop], y_centers[row_start:row_stop])
+        inside = np.zeros(x.shape, dtype=bool)
+        for ring in rings:
+            x1, y1 = ring[:, 0], ring[:, 1]
+            x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+            for ex1, ey1, ex2, ey2 in zip(x1, y1, x2, y2):
+                if ey1 == ey2:
+                    continue
+                crosses = (ey1 > y) != (ey2 > y)
+                x_cross = ex1 + (y - ey1) * (ex2 - ex1) / (ey2 - ey1)
+                inside ^= crosses & (x < x_cross)
+
+        labels[row_start:row_stop, col_start:col_stop][inside] = zone_i
+
+    return labels
+
+class ZoneIndex:
+    def __init__(self, header, zone_names, cell_index, offsets):
+        """The pixels in every zone of a PRISM grid.
+
+        Pixels are stored CSR style: cell_index holds the flat pixel
+        indexes of the first zone, then the second, etc., and the pixels of
+        zone i are cell_index[offsets[i]:offsets[i+1]]. Get one with
+        zone_index().
+
+        Parameters
+        ----------
+        header : dictionary
+            Header of the grid, see read_hdr
+
+        zone_names : list
+            Name of every zone
+
+        cell_index : numpy array
+            Flat pixel indexes, sorted by zone
+
+        offsets : numpy array
+            Where each zone starts in cell_index, with one extra entry at
+            the end.
+        """
+        self.header = header
+        self.zone_names = list(zone_names)
+        self.cell_index = cell_index
+        self.offsets = offsets
+        self.cell_zone = np.repeat(np.arange(len(self.zone_names), dtype='i4'), np.diff(offsets))
+
+    @classmethod
+    def from_labels(cls, header, zone_names, labels):
+        """
+        Make a ZoneIndex from a label grid, see rasterize_zones
+        """
+        flat_labels = labels.reshape(-1)
+        in_zone = np.flatnonzero(flat_labels >= 0)
+        order = np.argsort(flat_labels[in_zone], kind='stable')
+        cell_index = in_zone[order].astype('i8')
+        counts = np.bincount(flat_labels[in_zone], minlength=len(zone_names))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype('i8')
+        return cls(header, zone_names, cell_index, offsets)
+
+    @property
+    def grid(self):
+        return grid_of(self.header)
+
+    @property
+    def n_zones(self):
+        return len(self.zone_names)
+
+    def save(self, path):
+        """
+        Save to a .npz file, which can be read with ZoneIndex.load()
+        """
+        np.savez(path, cell_index=self.cell_index, offsets=self.offsets,
+                 header=np.array(json.dumps(self.header)),
+                 zone_names=np.array(json.dumps(self.zone_names)))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(json.loads(str(f['header'])), json.loads(str(f['zone_names'])),
+                       f['cell_index'], f['offsets'])
+
+    def stats(self, raster, stats=('mean',)):
+        """
+        Statistics of a PrismRaster for every zone, with a single pass over
+        the pixels in the zones. NODATA pixels are skipped. Returns a
+        dictionary of stat -> float64 array with one entry per zone, which
+        is nan for zones with no data.
+        """
+        if raster.grid != self.grid:
+            raise ValueError('{p} is not on the same grid as the zones'.format(p=raster.path))
+        values = raster.data.reshape(-1)[self.cell_index].astype('f8')
+        valid = ~np.isnan(values)
+        if raster.nodata is not None:
+            valid &= values != raster.nodata
+
+        count = np.bincount(self.cell_zone, weights=valid, minlength=self.n_zones)
+        no_data = count == 0
+        results = {}
+        if 'count' in stats:
+            results['count'] = count
+        if 'sum' in stats or 'mean' in stats:
+            total = np.bincount(self.cell_zone, weights=np.where(valid, values, 0), minlength=self.n_zones)
+            if 'sum' in stats:
+                results['sum'] = np.where(no_data, np.nan, total)
+            if 'mean' in stats:
+                results['mean'] = np.divide(total, count, out=np.full(self.n_zones, np.nan), where=~no_data)
+        # reduceat needs every segment to have at least one value
+        filled = self.offsets[:-1] < self.offsets[1:]
+        for stat, reduce, fill in [('min', np.minimum, np.inf), ('max', np.maximum, -np.inf)]:
+            if stat in stats:
+                result = np.full(self.n_zones, np.nan)
+                if len(values) > 0:
+                    reduced = reduce.reduceat(np.where(valid, values, fill), self.offsets[:-1][filled])
+                    result[filled] = reduced
+                result[no_data] = np.nan
+                results[stat] = result
+        return results
+
+def zone_index(header, zones, cache_dir=None):
+    """Rasterize zones onto a PRISM grid, or load them from the cache
+
+    Parameters
+    ----------
+    header : dictionary
+        Header of the grid, ie. PrismRaster.header
+
+    zones : dictionary
+        zone name -> polygon, see rasterize_zones
+
+    cache_dir : str, optional
+        Folder to save and load zone indexes in. They are keyed on the grid
+        and the zones, so changing either makes a new index.
+
+    Returns
+    -------
+    ZoneIndex
+    """
+    _require_numpy()
+    cache_path = None
+    if cache_dir is not None:
+        key = json.dumps([grid_of(header), [[str(name), [np.asarray(r, dtype='f8').tolist() for r in _polygon_rings(p)]]
+                                            for name, p in zones.items()]])
+        cache_path = os.path.join(cache_dir, 'zones_{h}.npz'.format(h=hashlib.sha1(key.encode()).hexdigest()))
+        if os.path.exists(cache_path):
+            return ZoneIndex.load(cache_path)
+
+    index = ZoneIndex.from_labels(header, list(zones), rasterize_zones(header, zones))
+    if cache_path is not None:
+        index.save(cache_path)
+    return index
+
+def zonal_stats(listing, zones, stats=('mean',), cache_dir=None):
+    """Statistics of many PRISM files over polygon zones, ie. county means
+
+    Zones are rasterized only once for every grid geometry, after that each
+    file takes one pass over the pixels in the zones.
+
+    Parameters
+    ----------
+    listing : list
+        PRISM files to use, ie. the output of prism_iterator filtered to
+        the dates and variables of interest.
+
+    zones : dictionary
+        zone name -> polygon, where a polygon is a list of (longitude,
+        latitude) points, or a list of several rings. See rasterize_zones.
+
+    stats : list of str, optional
+        Any of mean, sum, min, max, or count. Default is mean only.
+
+    cache_dir : str, optional
+        Folder to save the rasterized zones in, so later runs can skip
+        rasterizing them.
+
+    Returns
+    -------
+    dictionary
+        stat -> float64 array with shape (files, zones), where row i
+        matches listing[i] and columns are in the order of zones. Zones
+        with no data are nan.
+    """
+    _require_numpy()
+    for stat in stats:
+        if stat not in ZONAL_STATS:
+            raise ValueError('unknown stat {s}, must be one of {a}'.format(s=stat, a=ZONAL_STATS))
+
+    results = {s: np.full((len(listing), len(zones)), np.nan) for s in stats}
+    indexes = {}
+    for file_i, file_md in enumerate(listing):
+        r = open_prism(file_md['full_path'])
+        if r.grid not in indexes:
+            indexes[r.grid] = zone_index(r.header, zones, cache_dir=cache_dir)
+        for stat, values in indexes[r.grid].stats(r, stats).items():
+            results[stat][file_i] = values
+    return results
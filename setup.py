@@ -14,7 +14,12 @@ to the R package [prism](https://github.com/ropensci/prism)
 
 ## Installation
 
-Requires python 3. No other packages needed.
+Requires python 3. No other packages are needed for downloading. Reading
+the rasters, get_prism_catalog, and compact listings (prism_listing)
+require numpy, which can be installed along with the package:
+```
+pip install pyPRISMClimate[raster]
+```
 
 Install via pip
 ```
@@ -47,4 +52,5 @@ setup(name='pyPRISMClimate',
       license='MIT',
       python_requires='>=3.6.0',
       packages=find_packages(),
+      extras_require={'raster': ['numpy']},
       zip_safe=False)
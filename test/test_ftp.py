@@ -0,0 +1,477 @@
+import pyPRISMClimate
+from pyPRISMClimate import base, ftp_pool, retry
+from datetime import datetime
+import asyncio
+import io
+import os
+import threading
+import zipfile
+import pytest
+
+"""
+Offline tests of the download machinery. The PRISM ftp server is replaced
+with an in memory one holding small zip files with the same names and
+folder structure.
+"""
+
+def make_prism_zip(zip_name):
+    """
+    A zip with the same members as a real PRISM zip, ie. for
+    PRISM_tmax_stable_4kmD2_20160101_bil.zip
+    """
+    stem = zip_name.split('.')[0]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        z.writestr(stem + '.bil', b'\x00' * 16)
+        z.writestr(stem + '.hdr', 'NROWS 2\nNCOLS 2\n')
+    return buffer.getvalue()
+
+def daily_server_files(variable, year, days, status='stable'):
+    files = {}
+    for d in days:
+        date_str = '{y}01{d:02d}'.format(y=year, d=d)
+        name = 'PRISM_{v}_{s}_4kmD2_{d}_bil.zip'.format(v=variable, s=status, d=date_str)
+        path = 'daily/{v}/{y}/{n}'.format(v=variable, y=year, n=name)
+        files[path] = make_prism_zip(name)
+    return files
+
+class FakeFTPServer:
+    def __init__(self, files):
+        self.files = files
+        self.failing_files = set()
+        self.nlst_calls = 0
+        self.logins = 0
+        self.closes = 0
+        self.transfers = []
+        self.rest_offsets = []
+        self.drop_after = {}
+        self.after_transfer = None
+
+    def nlst(self, folder):
+        # only the files and folders directly in folder, like the real one
+        self.nlst_calls += 1
+        folder = folder.rstrip('/') + '/'
+        return sorted(set(folder + f[len(folder):].split('/')[0] for f in self.files if f.startswith(folder)))
+
+    def retrbinary(self, cmd, callback, rest=None):
+        path = cmd[len('RETR '):]
+        self.transfers.append(os.path.basename(path))
+        if path in self.failing_files:
+            raise ConnectionError('transfer failed: ' + path)
+        data = self.files[path][rest or 0:]
+        if rest is not None:
+            self.rest_offsets.append(rest)
+        if path in self.drop_after:
+            # send part of the file then lose the connection, once.
+            callback(data[:self.drop_after.pop(path)])
+            raise EOFError('connection dropped')
+        callback(data)
+        if self.after_transfer is not None:
+            self.after_transfer()
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    server = FakeFTPServer(daily_server_files('tmax', 2016, range(1, 11)))
+
+    class FakeFTP:
+        def __init__(self, host, user, passwd):
+            server.logins += 1
+            self.closed = False
+        def nlst(self, folder):
+            return server.nlst(folder)
+        def retrbinary(self, cmd, callback, rest=None):
+            return server.retrbinary(cmd, callback, rest)
+        def voidcmd(self, cmd):
+            if self.closed:
+                raise EOFError()
+            return '200 OK'
+        def close(self):
+            server.closes += 1
+            self.closed = True
+
+    monkeypatch.setattr(ftp_pool, 'FTP', FakeFTP)
+    monkeypatch.setattr(retry.time, 'sleep', lambda s: None)
+    return server
+
+def downloaded_dates(path):
+    return sorted(f['date'] for f in pyPRISMClimate.prism_iterator(str(path)))
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_daily_download(fake_server, tmpdir, max_workers):
+    pyPRISMClimate.get_prism_dailys(variable='tmax',
+                                    min_date='2016-01-01',
+                                    max_date='2016-01-10',
+                                    dest_path=str(tmpdir),
+                                    max_workers=max_workers)
+
+    assert downloaded_dates(tmpdir) == ['2016-01-{d:02d}'.format(d=d) for d in range(1, 11)]
+
+def test_concurrent_failures_do_not_abort(fake_server, tmpdir):
+    fake_server.failing_files.add('daily/tmax/2016/PRISM_tmax_stable_4kmD2_20160103_bil.zip')
+
+    daily = base.PrismDaily(variable='tmax',
+                            min_date='2016-01-01',
+                            max_date='2016-01-05',
+                            dest_path=str(tmpdir),
+                            max_workers=3)
+    daily.download()
+
+    assert list(daily.failed_downloads) == [datetime(2016, 1, 3)]
+    assert downloaded_dates(tmpdir) == ['2016-01-01', '2016-01-02', '2016-01-04', '2016-01-05']
+
+def test_quick_tools_return_failures(fake_server, tmpdir):
+    fake_server.failing_files.add('daily/tmax/2016/PRISM_tmax_stable_4kmD2_20160103_bil.zip')
+
+    failed = pyPRISMClimate.get_prism_dailys(variable='tmax',
+                                             min_date='2016-01-01',
+                                             max_date='2016-01-05',
+                                             dest_path=str(tmpdir),
+                                             retry_policy=pyPRISMClimate.RetryPolicy(max_attempts=1),
+                                             max_workers=3)
+    assert list(failed) == [datetime(2016, 1, 3)]
+    assert isinstance(failed[datetime(2016, 1, 3)], ConnectionError)
+
+def test_invalid_max_workers(fake_server, tmpdir):
+    with pytest.raises(ValueError):
+        base.PrismDaily(variable='tmax',
+                        min_date='2016-01-01',
+                        max_date='2016-01-05',
+                        dest_path=str(tmpdir),
+                        max_workers=0)
+
+def test_connections_are_reused(fake_server, tmpdir):
+    pyPRISMClimate.get_prism_dailys(variable='tmax',
+                                    min_date='2016-01-01',
+                                    max_date='2016-01-10',
+                                    dest_path=str(tmpdir))
+
+    assert fake_server.logins == 1
+
+def test_pool_replaces_dead_connections(fake_server):
+    pool = ftp_pool.FTPConnectionPool('host', 'user', 'passwd', max_size=2, check_after=0)
+    con = pool.acquire()
+    pool.release(con)
+    con.close()
+
+    assert pool.acquire() is not con
+    assert fake_server.logins == 2
+
+def test_listing_cache_persists_stable_folders(fake_server, tmpdir):
+    cache_path = str(tmpdir.join('listings.json'))
+    for _ in range(2):
+        daily = base.PrismDaily(variable='tmax',
+                                min_date='2016-01-01',
+                                max_date='2016-01-05',
+                                dest_path=str(tmpdir),
+                                listing_cache=cache_path)
+        assert daily.date_available(datetime(2016, 1, 2))
+
+    assert fake_server.nlst_calls == 1
+
+def test_listing_cache_expires_recent_folders(fake_server, tmpdir):
+    fake_server.files.update(daily_server_files('tmax', 2017, [1], status='provisional'))
+    cache = pyPRISMClimate.ListingCache(path=str(tmpdir.join('listings.json')),
+                                        recent_ttl=0)
+    for _ in range(2):
+        daily = base.PrismDaily(variable='tmax',
+                                min_date='2017-01-01',
+                                max_date='2017-01-01',
+                                dest_path=str(tmpdir),
+                                listing_cache=cache)
+        assert daily.get_date_status(datetime(2017, 1, 1)) == 'provisional'
+
+    assert fake_server.nlst_calls == 2
+
+def test_sync_only_downloads_missing_and_upgraded(fake_server, tmpdir):
+    for name in ['PRISM_tmax_stable_4kmD2_20160101_bil.zip',
+                 'PRISM_tmax_provisional_4kmD2_20160103_bil.zip']:
+        with zipfile.ZipFile(io.BytesIO(make_prism_zip(name))) as z:
+            z.extractall(str(tmpdir))
+
+    pyPRISMClimate.get_prism_dailys(variable='tmax',
+                                    min_date='2016-01-01',
+                                    max_date='2016-01-04',
+                                    dest_path=str(tmpdir),
+                                    sync=True)
+
+    assert sorted(fake_server.transfers) == ['PRISM_tmax_stable_4kmD2_20160102_bil.zip',
+                                             'PRISM_tmax_stable_4kmD2_20160103_bil.zip',
+                                             'PRISM_tmax_stable_4kmD2_20160104_bil.zip']
+    assert downloaded_dates(tmpdir) == ['2016-01-01', '2016-01-02', '2016-01-03', '2016-01-04']
+    assert not tmpdir.join('PRISM_tmax_provisional_4kmD2_20160103_bil.hdr').exists()
+
+@pytest.mark.parametrize('spool_size', [10, 1024 * 1024])
+def test_streamed_extraction_writes_no_zips(fake_server, tmpdir, spool_size):
+    daily = base.PrismDaily(variable='tmax',
+                            min_date='2016-01-01',
+                            max_date='2016-01-03',
+                            dest_path=str(tmpdir),
+                            keep_zip=False,
+                            spool_size=spool_size)
+    daily.download()
+
+    assert downloaded_dates(tmpdir) == ['2016-01-01', '2016-01-02', '2016-01-03']
+    assert tmpdir.listdir(fil=lambda f: f.ext == '.zip') == []
+
+    zip_size = len(fake_server.files['daily/tmax/2016/PRISM_tmax_stable_4kmD2_20160101_bil.zip'])
+    member_size = 16 + len('NROWS 2\nNCOLS 2\n')
+    spilled_size = zip_size if zip_size > spool_size else 0
+    assert daily.transfer_stats == {'files_downloaded'  : 3,
+                                    'bytes_downloaded'  : 3 * zip_size,
+                                    'bytes_written'     : 3 * (member_size + spilled_size),
+                                    'peak_buffer_bytes' : min(zip_size, spool_size)}
+
+def test_peak_buffer_counts_running_transfers(fake_server, tmpdir):
+    # hold both transfers open until each has received its whole file
+    fake_server.after_transfer = threading.Barrier(2, timeout=5).wait
+
+    daily = base.PrismDaily(variable='tmax',
+                            min_date='2016-01-01',
+                            max_date='2016-01-02',
+                            dest_path=str(tmpdir),
+                            keep_zip=False,
+                            max_workers=2)
+    daily.download()
+
+    zip_size = len(fake_server.files['daily/tmax/2016/PRISM_tmax_stable_4kmD2_20160101_bil.zip'])
+    assert daily.transfer_stats['peak_buffer_bytes'] == 2 * zip_size
+    assert daily._buffer_bytes == 0
+
+@pytest.mark.parametrize('keep_zip', [True, False])
+def test_dropped_transfer_resumes(fake_server, tmpdir, keep_zip):
+    path = 'daily/tmax/2016/PRISM_tmax_stable_4kmD2_20160101_bil.zip'
+    fake_server.drop_after[path] = 100
+
+    pyPRISMClimate.get_prism_daily_single(variable='tmax',
+                                          date='2016-01-01',
+                                          dest_path=str(tmpdir),
+                                          keep_zip=keep_zip)
+
+    assert fake_server.rest_offsets == [100]
+    assert downloaded_dates(tmpdir) == ['2016-01-01']
+    assert tmpdir.listdir(fil=lambda f: f.ext == '.part') == []
+
+def test_partial_file_from_earlier_run_is_resumed(fake_server, tmpdir):
+    name = 'PRISM_tmax_stable_4kmD2_20160101_bil.zip'
+    data = fake_server.files['daily/tmax/2016/' + name]
+    tmpdir.join(name + '.part').write_binary(data[:50])
+
+    pyPRISMClimate.get_prism_daily_single(variable='tmax',
+                                          date='2016-01-01',
+                                          dest_path=str(tmpdir))
+
+    assert fake_server.rest_offsets == [50]
+    assert tmpdir.join(name).read_binary() == data
+
+def test_retry_backoff_is_capped():
+    policy = pyPRISMClimate.RetryPolicy(backoff_base=2, backoff_cap=10, jitter=False)
+    assert [policy.wait_time(a) for a in range(1, 6)] == [2, 4, 8, 10, 10]
+
+    policy = pyPRISMClimate.RetryPolicy(backoff_base=2, backoff_cap=10)
+    assert all(0 <= policy.wait_time(a) <= 10 for a in range(1, 20))
+
+def test_permanent_errors_are_not_retried(fake_server):
+    calls = []
+    def missing_file():
+        calls.append(1)
+        raise base.error_perm('550 No such file')
+
+    with pytest.raises(base.error_perm):
+        pyPRISMClimate.RetryPolicy().call(missing_file)
+    assert len(calls) == 1
+
+    def disk_full():
+        calls.append(1)
+        raise OSError(28, 'No space left on device')
+
+    with pytest.raises(OSError):
+        pyPRISMClimate.RetryPolicy().call(disk_full)
+    assert len(calls) == 2
+
+def test_circuit_breaker_fails_fast(fake_server, tmpdir):
+    fake_server.failing_files.update(fake_server.files)
+    breaker = pyPRISMClimate.CircuitBreaker(failure_threshold=3, reset_timeout=600)
+    policy = pyPRISMClimate.RetryPolicy(max_attempts=2, circuit_breaker=breaker)
+
+    daily = base.PrismDaily(variable='tmax',
+                            min_date='2016-01-01',
+                            max_date='2016-01-10',
+                            dest_path=str(tmpdir),
+                            retry_policy=policy)
+    with pytest.raises(IOError):
+        daily.download()
+
+    with pytest.raises(base.CircuitOpenError):
+        daily.download()
+    assert len(fake_server.transfers) == 3
+
+def test_async_dailys(fake_server, tmpdir):
+    bil_paths = asyncio.run(pyPRISMClimate.aget_prism_dailys(variable='tmax',
+                                                             min_date='2016-01-01',
+                                                             max_date='2016-01-10',
+                                                             dest_path=str(tmpdir),
+                                                             max_concurrency=3))
+
+    assert sorted(os.path.basename(p) for p in bil_paths) == \
+        sorted(f['bil_filename'] for f in pyPRISMClimate.prism_iterator(str(tmpdir)))
+    assert downloaded_dates(tmpdir) == ['2016-01-{d:02d}'.format(d=d) for d in range(1, 11)]
+
+def test_async_iterator_yields_as_files_finish(fake_server, tmpdir):
+    async def first_file():
+        async for bil_path in pyPRISMClimate.aiter_prism_dailys(variable='tmax',
+                                                                min_date='2016-01-01',
+                                                                max_date='2016-01-10',
+                                                                dest_path=str(tmpdir),
+                                                                max_concurrency=1):
+            return bil_path
+
+    bil_path = asyncio.run(first_file())
+    assert os.path.exists(bil_path)
+
+def test_async_download_plan_runs_off_the_event_loop(fake_server, tmpdir, monkeypatch):
+    plan_threads = []
+    download_plan = base.PrismFTP._download_plan
+    def recording_plan(self):
+        plan_threads.append(threading.current_thread())
+        return download_plan(self)
+    monkeypatch.setattr(base.PrismFTP, '_download_plan', recording_plan)
+
+    asyncio.run(pyPRISMClimate.aget_prism_dailys(variable='tmax',
+                                                 min_date='2016-01-01',
+                                                 max_date='2016-01-02',
+                                                 dest_path=str(tmpdir),
+                                                 sync=True))
+    assert len(plan_threads) == 1
+    assert plan_threads[0] is not threading.main_thread()
+
+def test_async_iterator_stopped_early_closes_sessions(fake_server, tmpdir):
+    async def first_file():
+        async for bil_path in pyPRISMClimate.aiter_prism_dailys(variable='tmax',
+                                                                min_date='2016-01-01',
+                                                                max_date='2016-01-10',
+                                                                dest_path=str(tmpdir),
+                                                                max_concurrency=3):
+            return bil_path
+
+    asyncio.run(first_file())
+    assert fake_server.logins == fake_server.closes
+
+def test_pool_closes_sessions_released_after_close(fake_server):
+    pool = ftp_pool.FTPConnectionPool('host', 'user', 'passwd', max_size=2)
+    con = pool.acquire()
+    pool.close()
+    pool.release(con)
+    assert con.closed
+    assert pool._idle == []
+
+def test_batch_shares_one_session(fake_server, tmpdir):
+    fake_server.files.update(daily_server_files('tmin', 2016, range(1, 11)))
+    fake_server.failing_files.add('daily/tmin/2016/PRISM_tmin_stable_4kmD2_20160102_bil.zip')
+
+    failed = pyPRISMClimate.get_prism_batch([{'product' : 'daily',
+                                              'variable': ['tmin', 'tmax'],
+                                              'min_date': '2016-01-01',
+                                              'max_date': '2016-01-03'}],
+                                            max_workers=1,
+                                            retry_policy=pyPRISMClimate.RetryPolicy(max_attempts=1),
+                                            dest_path=str(tmpdir))
+
+    # the only new login is to replace the session dropped by the failure
+    assert fake_server.logins == 2
+    assert fake_server.nlst_calls == 2
+    assert list(failed) == [('daily/tmin', datetime(2016, 1, 2))]
+    downloaded = sorted((f['variable'], f['date']) for f in pyPRISMClimate.prism_iterator(str(tmpdir)))
+    assert downloaded == [('tmax', '2016-01-01'), ('tmax', '2016-01-02'), ('tmax', '2016-01-03'),
+                          ('tmin', '2016-01-01'), ('tmin', '2016-01-03')]
+
+def test_session_options_cannot_be_set_per_request(fake_server, tmpdir):
+    with pyPRISMClimate.PrismSession(dest_path=str(tmpdir), max_workers=2) as session:
+        with pytest.raises(ValueError, match='max_workers'):
+            session.add_dailys('tmax', min_date='2016-01-01', max_date='2016-01-02', max_workers=4)
+        assert session.requests == []
+
+def test_download_without_extracting(fake_server, tmpdir):
+    daily = base.PrismDaily(variable='tmax',
+                            min_date='2016-01-01',
+                            max_date='2016-01-02',
+                            dest_path=str(tmpdir),
+                            extract=False)
+    daily.download()
+
+    assert pyPRISMClimate.prism_iterator(str(tmpdir)) == []
+    zips = pyPRISMClimate.prism_iterator(str(tmpdir), extension='zip')
+    assert sorted(f['bil_filename'] for f in zips) == ['PRISM_tmax_stable_4kmD2_20160101_bil.bil',
+                                                       'PRISM_tmax_stable_4kmD2_20160102_bil.bil']
+
+@pytest.mark.parametrize('extract', [True, False])
+def test_single_return_path(fake_server, tmpdir, extract):
+    fake_server.files['monthly/tmax/2016/PRISM_tmax_stable_4kmM3_201601_bil.zip'] = \
+        make_prism_zip('PRISM_tmax_stable_4kmM3_201601_bil.zip')
+    extension = '.bil' if extract else '.zip'
+
+    daily_path = pyPRISMClimate.get_prism_daily_single(variable='tmax',
+                                                       date='2016-01-01',
+                                                       dest_path=str(tmpdir),
+                                                       return_path=True,
+                                                       extract=extract)
+    monthly_path = pyPRISMClimate.get_prism_monthly_single(variable='tmax',
+                                                           year=2016,
+                                                           month=1,
+                                                           dest_path=str(tmpdir),
+                                                           return_path=True,
+                                                           extract=extract)
+    for path in [daily_path, monthly_path]:
+        assert path.endswith(extension)
+        assert os.path.exists(path)
+
+def test_remote_catalog(fake_server, tmpdir):
+    np = pytest.importorskip('numpy')
+    fake_server.files.update(daily_server_files('tmax', 2017, [1, 2, 4], status='provisional'))
+    fake_server.files['daily/tmax/2017/readme.txt'] = b''
+
+    catalog = pyPRISMClimate.get_prism_catalog('tmax', dest_path=str(tmpdir), max_workers=2)
+    assert len(catalog) == 13
+    assert catalog[0]['full_path'].startswith('ftp://prism.nacse.org/daily/tmax/')
+    # the variable folder plus one listing per year
+    assert fake_server.nlst_calls == 3
+
+    provisional = catalog.filter(status='provisional').sort_by_date()
+    assert [f['date'] for f in provisional] == ['2017-01-01', '2017-01-02', '2017-01-04']
+    missing = catalog.missing_dates('2016-01-09', '2017-01-03')
+    assert len(missing) == 357
+    assert str(missing[-1]) == '2017-01-03'
+
+def test_remote_catalog_needs_numpy(fake_server, tmpdir, monkeypatch):
+    monkeypatch.setattr(pyPRISMClimate.raster, 'np', None)
+    with pytest.raises(ImportError, match=r'pyPRISMClimate\[raster\]'):
+        pyPRISMClimate.get_prism_catalog('tmax', dest_path=str(tmpdir))
+    # fails before listing anything
+    assert fake_server.nlst_calls == 0
+
+def test_remote_catalog_monthly(fake_server, tmpdir):
+    np = pytest.importorskip('numpy')
+    for name in ['PRISM_ppt_stable_4kmM3_2016{m:02d}_bil.zip'.format(m=m) for m in [1, 2, 3, 5]] + \
+                ['PRISM_ppt_stable_4kmM3_2016_bil.zip']:
+        fake_server.files['monthly/ppt/2016/' + name] = make_prism_zip(name)
+
+    monthly = base.PrismMonthly(variable='ppt', years=[2016], months=[1, 2, 3, 4],
+                                dest_path=str(tmpdir), max_workers=2)
+    catalog = pyPRISMClimate.PrismListing.from_dicts(monthly.remote_files())
+    assert set(catalog.values('type')) == {'monthly'}
+    assert [str(d) for d in catalog.missing_dates('2016-01', '2016-06')] == ['2016-04', '2016-06']
+    annual = dict(base.prism_md('PRISM_ppt_stable_4kmM3_2016_bil.zip'), full_path='annual.zip')
+    with_annual = pyPRISMClimate.PrismListing.from_dicts(catalog.to_dicts() + [annual])
+    assert len(with_annual.missing_dates('2016-01', '2016-06')) == 2
+
+    # the year folder is listed once, and reused to find the dates
+    assert monthly.check_downloads() == [datetime(2016, 4, 1)]
+    assert fake_server.nlst_calls == 2
+
+def test_check_downloads(fake_server, tmpdir, capsys):
+    daily = base.PrismDaily(variable='tmax',
+                            min_date='2016-01-09',
+                            max_date='2016-01-12',
+                            dest_path=str(tmpdir),
+                            max_workers=2)
+    assert daily.check_downloads() == [datetime(2016, 1, 12), datetime(2016, 1, 11)]
+    assert '2016-01-12, 2016-01-11' in capsys.readouterr().out
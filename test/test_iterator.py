@@ -1,4 +1,5 @@
 import pyPRISMClimate
+import os
 from pathlib import Path
 import pytest
 
@@ -117,6 +118,26 @@ filename_test_cases.append(('PRISM_ppt_30yr_normal_4kmM2_annual_bil.bil',
                                   'parsable':True,
                                   'parse_failue':None}))
 
+filename_test_cases.append(('PRISM_ppt_stable_4kmM3_2015_bil.bil',
+                                 {'variable':'ppt',
+                                  'type':'annual',
+                                  'resolution': '4km',
+                                  'status':'stable',
+                                  'date':'2015-01-01',
+                                  'date_details':{'year': 2015},
+                                  'parsable':True,
+                                  'parse_failue':None}))
+
+filename_test_cases.append(('PRISM_tmean-mean_provisional_4kmA_2016DJF_bil.bil',
+                                 {'variable':'tmean-mean',
+                                  'type':'seasonal',
+                                  'resolution': '4km',
+                                  'status':'provisional',
+                                  'date':'2015-12-01',
+                                  'date_details':{'season': 'DJF', 'year': 2016},
+                                  'parsable':True,
+                                  'parse_failue':None}))
+
 """
 Bad filenames
 """
@@ -143,3 +164,133 @@ filename_test_cases.append(('PRISM_ppt_stable_4kmD2_20180520_bil_extrainfo.bil',
 def test_prism_filenames(filename, expected_metadata):
     md = pyPRISMClimate.utils.prism_md(filename)
     assert md == expected_metadata
+
+def test_lazy_iterator(tmpdir):
+    nested = tmpdir.mkdir('daily').mkdir('2018')
+    for f in prism_filenames:
+        Path(str(tmpdir.join(f))).touch()
+    Path(str(nested.join('PRISM_ppt_provisional_4kmD2_20180601_bil.bil'))).touch()
+    Path(str(tmpdir.join('notes.txt'))).touch()
+
+    files = pyPRISMClimate.iter_prism_files(str(tmpdir))
+    assert not isinstance(files, list)
+    assert sorted(f['full_path'] for f in files) == sorted(f['full_path'] for f in pyPRISMClimate.prism_iterator(str(tmpdir)))
+
+    ppt = list(pyPRISMClimate.iter_prism_files(str(tmpdir), recursive=True, variable='ppt'))
+    assert len(ppt) == 5
+
+    filtered = list(pyPRISMClimate.iter_prism_files(str(tmpdir), recursive=True,
+                                                     variable=['ppt', 'tmax'],
+                                                     type='daily',
+                                                     status='stable',
+                                                     min_date='2018-01-01',
+                                                     max_date='2018-05-21'))
+    assert sorted(f['date'] for f in filtered) == ['2018-05-20', '2018-05-21']
+
+    normals = list(pyPRISMClimate.iter_prism_files(str(tmpdir), type='annual_normals', status='stable'))
+    assert len(normals) == 3
+
+def test_lazy_iterator_filters_before_parsing(tmpdir, monkeypatch):
+    for f in prism_filenames + tricky_filenames + ['PRISM_ppt_stable_4kmM3_2017_bil.bil',
+                                                   'PRISM_ppt_stable_4kmM3_2017DJF_bil.bil']:
+        Path(str(tmpdir.join(f))).touch()
+    everything = pyPRISMClimate.prism_iterator(str(tmpdir))
+    for filters in [{'type': 'daily'},
+                    {'type': ['monthly', 'annual']},
+                    {'type': 'seasonal', 'min_date': '2016-12-01'},
+                    {'min_date': '2016-01-01', 'max_date': '2018-05-21'},
+                    {'max_date': '2016-02-29'}]:
+        expected = [f for f in everything if f['parsable']
+                    and ('type' not in filters or f['type'] in filters['type'])
+                    and f['date'] >= filters.get('min_date', '')
+                    and f['date'] <= filters.get('max_date', '9999')]
+        found = pyPRISMClimate.iter_prism_files(str(tmpdir), **filters)
+        key = lambda f: f['full_path']
+        assert sorted(found, key=key) == sorted(expected, key=key)
+
+    parsed = []
+    prism_md = pyPRISMClimate.utils.prism_md
+    def counting_prism_md(filename):
+        parsed.append(filename)
+        return prism_md(filename)
+    monkeypatch.setattr(pyPRISMClimate.utils, 'prism_md', counting_prism_md)
+    found = list(pyPRISMClimate.iter_prism_files(str(tmpdir), type='daily', min_date='2018-05-21'))
+    # only matching files, normals, and unusual names are parsed
+    assert 'PRISM_ppt_stable_4kmD2_20180521_bil.bil' in parsed
+    assert [f for f in parsed if f in prism_filenames and 'normal' not in f] == \
+        [f['bil_filename'] for f in found]
+
+def test_catalog(tmpdir):
+    data_dir = tmpdir.mkdir('prism')
+    year_dir = data_dir.mkdir('2018')
+    for f in prism_filenames:
+        Path(str(data_dir.join(f))).touch()
+
+    with pyPRISMClimate.PrismCatalog(str(tmpdir.join('catalog.sqlite')), str(data_dir)) as catalog:
+        assert catalog.refresh() == 2
+        expected = sorted(pyPRISMClimate.prism_iterator(str(data_dir)), key=lambda f: (f['date'], f['full_path']))
+        assert catalog.query() == expected
+        assert catalog.refresh() == 0
+
+        Path(str(year_dir.join('PRISM_ppt_provisional_4kmD2_20180601_bil.bil'))).touch()
+        assert catalog.refresh() == 1
+        ppt = catalog.query(variable='ppt', type='daily', min_date='2018-05-22')
+        assert [(f['date'], f['status']) for f in ppt] == [('2018-05-22', 'stable'),
+                                                          ('2018-05-23', 'stable'),
+                                                          ('2018-06-01', 'provisional')]
+        assert len(catalog.query(status='provisional')) == 1
+
+    # the catalog persists, and deleted files are removed
+    os.remove(str(year_dir.join('PRISM_ppt_provisional_4kmD2_20180601_bil.bil')))
+    with pyPRISMClimate.PrismCatalog(str(tmpdir.join('catalog.sqlite')), str(data_dir)) as catalog:
+        assert len(catalog.query(variable='ppt')) == 5
+        catalog.refresh()
+        assert len(catalog.query(variable='ppt')) == 4
+
+"""
+The regex fast path of prism_md must match the full parser exactly
+"""
+tricky_filenames = ['PRISM_ppt_early_4kmD2_20160230_bil.bil',
+                    'PRISM_ppt_stable_4kmD2_20161301_bil.bil',
+                    'PRISM_ppt_stable_4kmM3_201600_bil.bil',
+                    'PRISM_ppt_stable_4kmM3_0000_bil.bil',
+                    'PRISM_ppt_stable_4kmM3_0001DJF_bil.bil',
+                    'PRISM_ppt_stable_4kmM3_2016XYZ_bil.bil',
+                    'PRISM_ppt_stable_800mD2_20160101_bil',
+                    'PRISM_ppt_stable_4kmD2_20160101_bil_extra.bil',
+                    'PRISM_ppt_stable_D2_20160101_bil.bil',
+                    'prism_ppt_stable_4kmD2_20160101_bil.bil',
+                    'PRISM_ppt_stable_4kmD2_2016-01-01_bil.bil',
+                    'PRISM_ppt_stable_4kmD2_２０１６０１０１_bil.bil',
+                    'PRISM_tmax_30yr_normal_800mM2_13_bil.bil']
+
+@pytest.mark.parametrize('filename', [f for f, md in filename_test_cases] + prism_filenames + tricky_filenames)
+def test_fast_path_matches_full_parser(filename):
+    assert pyPRISMClimate.utils.prism_md(filename) == pyPRISMClimate.utils._full_prism_md(filename)
+
+def test_prism_md_batch():
+    # twice, so dates already seen in the batch are checked too
+    filenames = ([f for f, md in filename_test_cases] + tricky_filenames) * 2
+    columns = pyPRISMClimate.prism_md_batch(filenames)
+    for i, filename in enumerate(filenames):
+        assert {k:v[i] for k, v in columns.items()} == pyPRISMClimate.utils.prism_md(filename)
+
+def test_compact_listing(tmpdir):
+    np = pytest.importorskip('numpy')
+    for f in prism_filenames + ['PRISM_ppt-sum_stable_4kmA_2016DJF_bil.bil', 'notes_bil.bil']:
+        Path(str(tmpdir.join(f))).touch()
+
+    listing = pyPRISMClimate.prism_listing(str(tmpdir))
+    assert len(listing) == 25
+    key = lambda f: f['full_path']
+    assert sorted(listing.to_dicts(), key=key) == sorted(pyPRISMClimate.prism_iterator(str(tmpdir)), key=key)
+    assert listing.records.dtype['date'] == np.dtype('datetime64[D]')
+
+    ppt = listing.filter(variable='ppt', type='daily', max_date='2018-05-22').sort_by_date()
+    assert [f['date'] for f in ppt] == ['2018-05-20', '2018-05-21', '2018-05-22']
+    assert ppt[0]['date_details'] == {'day': 20, 'month': 5, 'year': 2018}
+    assert list(ppt.values('variable')) == ['ppt'] * 3
+    assert len(listing.filter(variable='vpdmax')) == 0
+
+    compact = pyPRISMClimate.PrismListing.from_dicts(pyPRISMClimate.prism_iterator(str(tmpdir)))
+    assert len(compact.filter(type=['annual_normals', 'monthly_normals'])) == 5
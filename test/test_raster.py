@@ -0,0 +1,332 @@
+import pyPRISMClimate
+import os
+import pytest
+import zipfile
+
+np = pytest.importorskip('numpy')
+
+from pyPRISMClimate import raster
+
+"""
+Reading rasters from small synthetic bil files laid out like the PRISM ones.
+"""
+
+def write_bil(path, data, nodata=-9999, ulxmap=-125.0, ulymap=49.9, dim=0.5, byteorder='I'):
+    """
+    Write a float32 bil and hdr pair, ie. path=/tmp/PRISM_tmax_stable_4kmD2_20160101_bil.bil
+    """
+    dtype = '<f4' if byteorder == 'I' else '>f4'
+    np.asarray(data, dtype=dtype).tofile(str(path))
+    hdr = '\n'.join(['BYTEORDER      {b}'.format(b=byteorder),
+                     'LAYOUT         BIL',
+                     'NROWS          {r}'.format(r=data.shape[0]),
+                     'NCOLS          {c}'.format(c=data.shape[1]),
+                     'NBANDS         1',
+                     'NBITS          32',
+                     'PIXELTYPE      FLOAT',
+                     'ULXMAP         {x}'.format(x=ulxmap),
+                     'ULYMAP         {y}'.format(y=ulymap),
+                     'XDIM           {d}'.format(d=dim),
+                     'YDIM           {d}'.format(d=dim),
+                     'NODATA         {n}'.format(n=nodata)])
+    with open(raster.hdr_path_for(str(path)), 'w') as f:
+        f.write(hdr)
+    return str(path)
+
+def test_open_bil(tmpdir):
+    data = np.arange(12, dtype='f4').reshape(3, 4)
+    bil_path = write_bil(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil'), data)
+
+    r = pyPRISMClimate.open_bil(bil_path)
+
+    assert isinstance(r.data, np.memmap)
+    assert r.shape == (3, 4)
+    assert r.nodata == -9999
+    assert r.transform == (-125.25, 0.5, 0.0, 50.15, 0.0, -0.5)
+    np.testing.assert_array_equal(r.data, data)
+
+def test_big_endian_bil(tmpdir):
+    data = np.arange(6, dtype='f4').reshape(2, 3)
+    bil_path = write_bil(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil'), data, byteorder='M')
+
+    np.testing.assert_array_equal(pyPRISMClimate.open_bil(bil_path).read(), data)
+
+def test_masked_nodata(tmpdir):
+    data = np.array([[1, -9999], [3, 4]], dtype='f4')
+    bil_path = write_bil(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil'), data)
+
+    assert pyPRISMClimate.open_bil(bil_path).read(masked=True).mask.tolist() == [[False, True], [False, False]]
+
+def test_xy_to_rowcol(tmpdir):
+    data = np.zeros((3, 4), dtype='f4')
+    r = pyPRISMClimate.open_bil(write_bil(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil'), data))
+
+    rows, cols = r.xy_to_rowcol([-125.0, -123.3, -130.0], [49.9, 48.9, 49.9])
+    assert rows.tolist() == [0, 2, -1]
+    assert cols.tolist() == [0, 3, -1]
+
+def test_open_prism_zip(tmpdir):
+    data = np.arange(12, dtype='f4').reshape(3, 4)
+    bil_path = write_bil(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil'), data)
+    zip_path = str(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.zip'))
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        z.write(bil_path, os.path.basename(bil_path))
+        z.write(raster.hdr_path_for(bil_path), os.path.basename(raster.hdr_path_for(bil_path)))
+
+    from_zip = pyPRISMClimate.open_prism(zip_path)
+    from_bil = pyPRISMClimate.open_prism(bil_path)
+
+    assert from_zip.header == from_bil.header
+    np.testing.assert_array_equal(from_zip.data, from_bil.data)
+
+def write_daily_series(path, variable, dates, shape=(3, 4)):
+    """
+    A bil file for every date, where each pixel's value is its flat index
+    plus 100 * the position of the date.
+    """
+    base_grid = np.arange(shape[0] * shape[1], dtype='f4').reshape(shape)
+    for i, d in enumerate(dates):
+        filename = 'PRISM_{v}_stable_4kmD2_{d}_bil.bil'.format(v=variable, d=d.replace('-', ''))
+        write_bil(path.join(filename), base_grid + 100 * i)
+    return base_grid
+
+def test_cube_build_and_append(tmpdir):
+    dates = ['2016-01-0{d}'.format(d=d) for d in range(1, 8)]
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', dates[:5])
+    write_daily_series(data_dir, 'tmin', dates[:5])
+
+    cube = pyPRISMClimate.build_cube(pyPRISMClimate.prism_iterator(str(data_dir)),
+                                     str(tmpdir.join('cube')),
+                                     variable='tmax',
+                                     chunk_size=2)
+    assert cube.shape == (5, 3, 4)
+    assert cube.series(1, 2).tolist() == [6, 106, 206, 306, 406]
+
+    write_daily_series(data_dir, 'tmax', dates)
+    assert pyPRISMClimate.PrismCube(str(tmpdir.join('cube'))).append(pyPRISMClimate.prism_iterator(str(data_dir))) == 2
+
+    cube = pyPRISMClimate.PrismCube(str(tmpdir.join('cube')))
+    assert cube.dates == dates
+    assert cube.series_at(-124.0, 49.4).tolist() == [i * 100 + 6 for i in range(7)]
+    np.testing.assert_array_equal(cube.read_date('2016-01-06'), np.arange(12).reshape(3, 4) + 500)
+    # the last date is still in the tail, not a chunk
+    np.testing.assert_array_equal(cube.read_date('2016-01-07'), np.arange(12).reshape(3, 4) + 600)
+    assert sorted(f.basename for f in tmpdir.join('cube').listdir(lambda p: p.ext == '.dat')) == \
+        ['chunk_00000.dat', 'chunk_00001.dat', 'chunk_00002.dat', 'tail.dat']
+
+def test_cube_only_appends_later_dates(tmpdir):
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', ['2016-01-05'])
+    cube = pyPRISMClimate.build_cube(pyPRISMClimate.prism_iterator(str(data_dir)), str(tmpdir.join('cube')))
+
+    write_daily_series(data_dir, 'tmax', ['2016-01-01'])
+    with pytest.raises(ValueError):
+        cube.append(pyPRISMClimate.prism_iterator(str(data_dir)))
+
+def test_extract_points(tmpdir):
+    dates = ['2016-01-01', '2016-01-02', '2016-01-03']
+    write_daily_series(tmpdir, 'tmax', dates)
+    # make a single NODATA pixel on the last date
+    last = raster.open_bil(str(tmpdir.join('PRISM_tmax_stable_4kmD2_20160103_bil.bil')), mode='r+')
+    last.data[0, 0] = -9999
+    last.data.flush()
+
+    listing = sorted(pyPRISMClimate.prism_iterator(str(tmpdir)), key=lambda f: f['date'])
+    values = pyPRISMClimate.extract_points(listing,
+                                           lons=[-124.0, -125.0, -140.0],
+                                           lats=[49.4, 49.9, 49.9])
+
+    assert values.shape == (3, 3)
+    np.testing.assert_array_equal(values, [[6, 106, 206],
+                                           [0, 100, np.nan],
+                                           [np.nan, np.nan, np.nan]])
+
+def test_bbox_read(tmpdir):
+    data = np.arange(12, dtype='f4').reshape(3, 4)
+    r = pyPRISMClimate.open_bil(write_bil(tmpdir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil'), data))
+
+    # pixel centers are at lon -125, -124.5, -124, -123.5 and lat 49.9, 49.4, 48.9
+    assert raster.window_from_bbox(r.header, (-124.6, 48.8, -124.1, 49.5)) == (1, 3, 1, 3)
+    np.testing.assert_array_equal(r.read(bbox=(-124.6, 48.8, -124.1, 49.5)), [[5, 6], [9, 10]])
+    np.testing.assert_array_equal(r.read(window=(0, 1, 2, 10)), [[2, 3]])
+
+    subset = r.subset(bbox=(-124.6, 48.8, -124.1, 49.5))
+    assert subset.shape == (2, 2)
+    assert subset.xy_to_rowcol(-124.0, 48.9) == (1, 1)
+
+    with pytest.raises(ValueError):
+        r.read(bbox=(-100, 30, -99, 31))
+
+def test_aggregate_prism(tmpdir):
+    data_dir = tmpdir.mkdir('prism')
+    out_dir = tmpdir.mkdir('out')
+    dates = ['2015-12-31', '2016-01-01', '2016-01-02', '2016-02-01']
+    write_daily_series(data_dir, 'ppt', dates)
+    # a NODATA pixel in one of the January files
+    jan_2 = raster.open_bil(str(data_dir.join('PRISM_ppt_stable_4kmD2_20160102_bil.bil')), mode='r+')
+    jan_2.data[0, 0] = -9999
+    jan_2.data.flush()
+
+    written = pyPRISMClimate.aggregate_prism(pyPRISMClimate.prism_iterator(str(data_dir)),
+                                             str(out_dir),
+                                             stats=['sum', 'std', 'count'])
+    assert len(written) == 9
+
+    monthly = {(f['variable'], f['date']): f for f in pyPRISMClimate.prism_iterator(str(out_dir))}
+    assert monthly[('ppt-sum', '2016-01-01')]['type'] == 'monthly'
+    january_sum = pyPRISMClimate.open_bil(monthly[('ppt-sum', '2016-01-01')]['full_path']).read()
+    # values are the pixel number + 100 for every day after the first
+    np.testing.assert_array_equal(january_sum.ravel()[:3], [100, 302, 304])
+    january_std = pyPRISMClimate.open_bil(monthly[('ppt-std', '2016-01-01')]['full_path']).read(masked=True)
+    assert january_std.mask[0, 0]
+    np.testing.assert_allclose(january_std[0, 1], np.std([101, 201], ddof=1))
+
+    written = pyPRISMClimate.aggregate_prism(pyPRISMClimate.prism_iterator(str(data_dir)),
+                                             str(out_dir),
+                                             period='seasonal',
+                                             stats=['max'])
+    assert [os.path.basename(p) for p in written] == ['PRISM_ppt-max_stable_4kmA_2016DJF_bil.bil']
+    np.testing.assert_array_equal(pyPRISMClimate.open_bil(written[0]).read().ravel()[:2], [300, 301])
+
+@pytest.mark.parametrize('compression', ['zlib', 'lzma'])
+def test_archive(tmpdir, compression):
+    dates = ['2016-01-0{d}'.format(d=d) for d in range(1, 8)]
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', dates, shape=(5, 4))
+
+    archive = pyPRISMClimate.build_archive(pyPRISMClimate.prism_iterator(str(data_dir)),
+                                           str(tmpdir.join('archive')),
+                                           chunk_size=3,
+                                           band_rows=2,
+                                           compression=compression)
+    assert archive.shape == (7, 5, 4)
+
+    archive = pyPRISMClimate.PrismArchive(str(tmpdir.join('archive')))
+    assert archive.dates == dates
+    assert archive.series(4, 1).tolist() == [i * 100 + 17 for i in range(7)]
+    assert archive.series_at(-124.0, 49.4).tolist() == [i * 100 + 6 for i in range(7)]
+    np.testing.assert_array_equal(archive.read_date('2016-01-07'), np.arange(20).reshape(5, 4) + 600)
+
+def test_archive_from_zips(tmpdir):
+    dates = ['2016-01-0{d}'.format(d=d) for d in range(1, 6)]
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', dates, shape=(5, 4))
+    for bil_path in data_dir.listdir(lambda p: p.ext == '.bil'):
+        hdr_path = raster.hdr_path_for(str(bil_path))
+        with zipfile.ZipFile(str(bil_path).replace('.bil', '.zip'), 'w') as z:
+            z.write(str(bil_path), bil_path.basename)
+            z.write(hdr_path, os.path.basename(hdr_path))
+
+    archive = pyPRISMClimate.build_archive(pyPRISMClimate.prism_iterator(str(data_dir), extension='zip'),
+                                           str(tmpdir.join('archive')),
+                                           chunk_size=2,
+                                           band_rows=2)
+    assert archive.series(4, 1).tolist() == [i * 100 + 17 for i in range(5)]
+    np.testing.assert_array_equal(archive.read_date('2016-01-05'), np.arange(20).reshape(5, 4) + 400)
+    assert sorted(os.listdir(str(tmpdir.join('archive')))) == ['data.bin', 'index.json']
+
+def test_land_cells(tmpdir):
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', ['2016-01-01', '2016-01-02'])
+    # ocean along the first row of every date
+    for bil_path in data_dir.listdir():
+        if str(bil_path).endswith('.bil'):
+            r = raster.open_bil(str(bil_path), mode='r+')
+            r.data[0] = -9999
+            r.data.flush()
+
+    listing = sorted(pyPRISMClimate.prism_iterator(str(data_dir)), key=lambda f: f['date'])
+    cells, values = pyPRISMClimate.compact_prism(listing, cache_dir=str(tmpdir))
+    assert cells.n_cells == 8
+    assert values.shape == (2, 8)
+    assert values[1].tolist() == list(range(104, 112))
+
+    grids = cells.scatter(values)
+    assert grids.shape == (2, 3, 4)
+    assert np.isnan(grids[:, 0]).all()
+    np.testing.assert_array_equal(grids[0, 1:], np.arange(4, 12).reshape(2, 4))
+
+    # made once and reused, and saved to the cache
+    assert pyPRISMClimate.land_cells(listing[1]) is cells
+    loaded = pyPRISMClimate.LandCells.load(str(tmpdir.listdir(lambda p: p.ext == '.npz')[0]))
+    assert loaded.grid == cells.grid
+    assert loaded.mask.tolist() == cells.mask.tolist()
+
+def test_land_cells_cache(tmpdir):
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', ['2016-01-01'], shape=(2, 5))
+    file_md = pyPRISMClimate.prism_iterator(str(data_dir))[0]
+
+    pyPRISMClimate.clear_land_cells()
+    cells = pyPRISMClimate.land_cells(file_md)
+    assert cells.n_cells == 10
+    # already in memory, but still saved to a new cache_dir
+    cache_dir = tmpdir.mkdir('cache')
+    assert pyPRISMClimate.land_cells(file_md, cache_dir=str(cache_dir)) is cells
+    assert len(cache_dir.listdir(lambda p: p.ext == '.npz')) == 1
+
+    r = raster.open_bil(file_md['full_path'], mode='r+')
+    r.data[0, 0] = -9999
+    r.data.flush()
+    assert pyPRISMClimate.land_cells(file_md, use_cache=False).n_cells == 9
+    assert pyPRISMClimate.land_cells(file_md) is cells
+
+    pyPRISMClimate.clear_land_cells()
+    assert pyPRISMClimate.land_cells(file_md).n_cells == 9
+
+def test_derived_variables(tmpdir):
+    dates = ['2016-01-01', '2016-01-02', '2016-01-03']
+    for variable, day_values in [('tmin', [-5, 5, 12]), ('tmax', [8, 20, 40])]:
+        for d, value in zip(dates, day_values):
+            filename = 'PRISM_{v}_stable_4kmD2_{d}_bil.bil'.format(v=variable, d=d.replace('-', ''))
+            write_bil(tmpdir.join(filename), np.full((2, 2), value, dtype='f4'))
+    # tmax is missing on the last date
+    os.remove(str(tmpdir.join('PRISM_tmax_stable_4kmD2_20160103_bil.bil')))
+    listing = pyPRISMClimate.prism_iterator(str(tmpdir))
+
+    joined = pyPRISMClimate.join_by_date(listing, ['tmin', 'tmax'])
+    assert [d for d, files in joined] == dates[:2]
+
+    gdd = [(d, grid[0, 0]) for d, grid in pyPRISMClimate.derive_prism(listing, pyPRISMClimate.GrowingDegreeDays(base=10, cap=30, cumulative=True))]
+    # (10 + 10) / 2 - 10 = 0, then (10 + 20) / 2 - 10 = 5
+    assert gdd == [('2016-01-01', 0), ('2016-01-02', 5)]
+
+    frost = [grid[1, 1] for d, grid in pyPRISMClimate.derive_prism(listing, pyPRISMClimate.ThresholdCount('tmin', 0))]
+    assert frost == [1, 1, 1]
+
+    totals = [grid[0, 1] for d, grid in pyPRISMClimate.derive_prism(listing, pyPRISMClimate.CumulativeSum('tmin', start_date='2016-01-02'))]
+    assert totals == [5, 17]
+
+    class TemperatureRange:
+        variables = ['tmin', 'tmax']
+        def __call__(self, date, arrays, out):
+            np.subtract(arrays['tmax'], arrays['tmin'], out=out)
+
+    ranges = [grid[0, 0] for d, grid in pyPRISMClimate.derive_prism(listing, TemperatureRange())]
+    assert ranges == [13, 15]
+
+def test_zonal_stats(tmpdir):
+    data_dir = tmpdir.mkdir('prism')
+    write_daily_series(data_dir, 'tmax', ['2016-01-01', '2016-01-02'])
+    first = raster.open_bil(str(data_dir.join('PRISM_tmax_stable_4kmD2_20160101_bil.bil')), mode='r+')
+    first.data[0, 0] = -9999
+    first.data.flush()
+    listing = sorted(pyPRISMClimate.prism_iterator(str(data_dir)), key=lambda f: f['date'])
+
+    # pixel centers are at lon -125, -124.5, -124, -123.5 and lat 49.9, 49.4, 48.9
+    zones = {'west': [(-125.2, 50), (-124.7, 50), (-124.7, 48.5), (-125.2, 48.5)],
+             'northeast': [(-124.2, 50), (-123.2, 50), (-123.2, 49.2), (-124.2, 49.2)],
+             'offshore': [(-130, 50), (-129, 50), (-129, 49)]}
+    labels = pyPRISMClimate.rasterize_zones(first.header, zones)
+    assert labels.tolist() == [[0, -1, 1, 1], [0, -1, 1, 1], [0, -1, -1, -1]]
+
+    results = pyPRISMClimate.zonal_stats(listing, zones, stats=['mean', 'min', 'max', 'count'], cache_dir=str(tmpdir))
+    np.testing.assert_array_equal(results['count'], [[2, 4, 0], [3, 4, 0]])
+    np.testing.assert_array_equal(results['min'], [[4, 2, np.nan], [100, 102, np.nan]])
+    np.testing.assert_array_equal(results['max'], [[8, 7, np.nan], [108, 107, np.nan]])
+    np.testing.assert_allclose(results['mean'][1], [104, 104.5, np.nan])
+
+    cached = [p for p in tmpdir.listdir() if p.ext == '.npz']
+    assert len(cached) == 1
+    assert pyPRISMClimate.ZoneIndex.load(str(cached[0])).zone_names == ['west', 'northeast', 'offshore']